@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+import os
+import json
+import uuid
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = "transform_journal.jsonl"
+
+PENDING, COMMITTED, DONE, ABANDONED = "pending", "committed", "done", "abandoned"
+
+
+class BatchJournal:
+    """ Append-only, write-ahead record of which input files went into which db batch, and how far each batch got.
+
+    A batch is recorded as pending before anything is written to the database, committed once its load transaction
+    has committed, and done once its files have been moved to done/. Every record is fsynced, so after a crash the
+    journal tells exactly which batches may be half-finished. Whether such a batch made it into the database is
+    settled by the marker row written inside the load transaction itself (see db_builder.record_batch_commit).
+    """
+    def __init__(self, read_path):
+        self.path = os.path.join(read_path, JOURNAL_FILENAME)
+        self.batches = {}
+        self.torn_tail = False
+        if os.path.exists(self.path):
+            self._replay()
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                self.torn_tail = not line.endswith("\n")
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line means the process died mid-write: that record never took effect
+                    logger.warning(f"Ignoring unreadable journal line in {self.path}: {line!r}")
+                    continue
+                batch = self.batches.setdefault(record["batch_id"], {"files": [], "state": None})
+                if "files" in record:
+                    batch["files"] = record["files"]
+                batch["state"] = record["state"]
+
+    def _write(self, record):
+        record["time"] = datetime.now().isoformat()
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self.torn_tail:
+                # Start on a fresh line, so the torn record can't swallow this one
+                f.write("\n")
+                self.torn_tail = False
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        batch = self.batches.setdefault(record["batch_id"], {"files": [], "state": None})
+        if "files" in record:
+            batch["files"] = record["files"]
+        batch["state"] = record["state"]
+
+    def begin(self, files):
+        batch_id = uuid.uuid4().hex
+        self._write({"batch_id": batch_id, "state": PENDING, "files": list(files)})
+        return batch_id
+
+    def mark_committed(self, batch_id):
+        self._write({"batch_id": batch_id, "state": COMMITTED})
+
+    def mark_done(self, batch_id):
+        self._write({"batch_id": batch_id, "state": DONE})
+
+    def mark_abandoned(self, batch_id):
+        self._write({"batch_id": batch_id, "state": ABANDONED})
+
+    def unfinished(self):
+        """ Returns {batch_id: files} for batches that were started but whose files were never moved to done/. """
+        return {k: v["files"] for k, v in self.batches.items() if v["state"] in (PENDING, COMMITTED)}
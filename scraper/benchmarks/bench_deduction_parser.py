@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+"""
+Throughput benchmark: deduction_parser.parse_candidates vs. the legacy DeductionRow re-parse of rows i, i..i+1 and
+i..i+2, per deduction format.
+
+Run from this directory: python bench_deduction_parser.py [repeats]
+"""
+
+import os
+import sys
+import timeit
+import logging
+
+p_list = [os.path.abspath("../classes/")]
+for path in p_list:
+    if path not in sys.path:
+        sys.path.append(path)
+
+try:
+    import datarow
+    import deduction_parser
+except ImportError as exc:
+    sys.exit(f"Error: failed to import module ({exc})")
+
+# Deduction rows i..i+2 (non-empty cells) as they come out of converted protocols, with the expected total
+CORPUS = {
+    "pre-2005": [
+        ([["Deductions:", "Costume & Prop violation:", "0", "Time violation:", "0", "Illegal Element:", "0"],
+          ["Falls:", "-1.0", "Music violation:", "0", "-1.0"],
+          ["Referee", "Judge No.1"]], -1),
+        ([["Deductions:", "Costume & Prop violation: 0", "Time violation: 0", "Illegal Element: 0", "-2.0"],
+          ["Falls: -2.0", "Music violation: 0"],
+          []], -2),
+        ([["Deductions:", "Costume & Prop violation:", "0", "Time violation:", "-1.0", "Illegal Element:", "0"],
+          ["Falls:", "-1.0", "Music violation:", "0", "-2.0"],
+          ["Printed: 14.02.2004 21:14:55"]], -2),
+    ],
+    "Torino": [
+        ([["Deductions:", "Falls:", "-1.00", "Time violation:", "0.00", "Costume & Prop violation:", "0.00"],
+          ["Illegal Element:", "0.00", "Music violation:", "0.00", "-1.00"],
+          []], -1),
+        ([["Deductions:", "Falls:", "-2.00", "Time violation:", "-1.00", "Costume & Prop violation:", "0.00"],
+          ["Illegal Element:", "0.00", "Music violation:", "0.00", "-3.00"],
+          []], -3),
+    ],
+    "modern": [
+        ([["Deductions:", "Falls: -1.00(1)", "-1.00"], [], []], -1),
+        ([["Deductions:", "Falls:", "-2.00", "(2)", "Time violation:", "-1.00", "-3.00"], [], []], -3),
+        ([["Deductions", "Falls:\nTime violation:", "-1.00\n-1.00", "-2.00"], [], []], -2),
+        ([["Deductions:", "Extended lifts:", "-1.00", "Falls:", "-2.00", "(2)", "-3.00"], [], []], -3),
+        ([["Deductions:", "Falls:", "-1.00", "(1)", "Costume/Prop violation: (2 of 7)", "-1.00"], [], []], -1),
+    ],
+}
+
+
+def legacy(rows, total):
+    """ What Protocol.parse_deductions used to do: re-run DeductionRow on growing concatenations of rows. """
+    for n in range(1, len(rows) + 1):
+        try:
+            ded_dic = datarow.DeductionRow(raw=[c for r in rows[:n] for c in r]).ded_detail
+        except ValueError:
+            continue
+        if sum(ded_dic.values()) == total:
+            return ded_dic
+    return None
+
+
+def grammar(rows, total):
+    for ded_dic in deduction_parser.parse_candidates(rows):
+        if ded_dic is not None and sum(ded_dic.values()) == total:
+            return ded_dic
+    return None
+
+
+def check_equivalence():
+    for fmt, cases in CORPUS.items():
+        for rows, total in cases:
+            expected = legacy(rows, total)
+            if expected is None:
+                # Votes on a violation "(k of n)", which DeductionRow never handled
+                assert grammar(rows, total) is not None, f"{fmt}: grammar parser did not match {rows}"
+            else:
+                assert grammar(rows, total) == expected, f"{fmt}: {grammar(rows, total)} != {expected} for {rows}"
+
+
+def main(repeats=500):
+    logging.disable(logging.CRITICAL)
+    check_equivalence()
+    for fmt, cases in CORPUS.items():
+        for name, func in [("legacy", legacy), ("grammar", grammar)]:
+            elapsed = timeit.timeit(lambda: [func(rows, total) for rows, total in cases], number=repeats)
+            print(f"{fmt:<9} {name:<8} {repeats * len(cases) / elapsed:>10,.0f} protocols/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
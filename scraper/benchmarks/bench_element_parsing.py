@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+"""
+Throughput benchmark: finding the pattern family of element labels with element.match_families (one combined scan)
+vs. the per-pattern re.findall trials it replaced, per meta-discipline. Parses are uncached here, as for the first
+sighting of each label.
+
+Run from this directory: python bench_element_parsing.py [repeats]
+"""
+
+import os
+import re
+import sys
+import timeit
+import logging
+
+p_list = [os.path.abspath("../classes/"), os.path.abspath("../")]
+for path in p_list:
+    if path not in sys.path:
+        sys.path.append(path)
+
+try:
+    import element
+except ImportError as exc:
+    sys.exit(f"Error: failed to import module ({exc})")
+
+# Element labels (calls to impute and H2 flags already stripped) as they appear in protocols across eras
+CORPUS = {
+    "IceDance": ["1RH4+kpYYNY", "2TR3+kpYYY", "PSt1+kpNN", "1S1", "2S3*", "GW1Se", "CC2Sq4+kpYYY", "SqTwB",
+                 "NtMiSt+STw", "CuLi4", "RoLi4+RoLi4", "StaLi4", "CoSp3", "SlLi4", "MiSt2", "DiSt3", "PiF2",
+                 "ChSl1", "ChLi1", "SyTwW4+SyTwM4", "OFT3", "Li+TRANS", "FoSt4", "ChTw1", "CiSt2", "SeSt3"],
+    "Singles": ["3A", "4T+3T", "3Lz+3T<", "3F!", "2A+1Eu+3S", "3Lo<<", "3Lz+2T+2Lo", "3S+SEQ", "1Lz*", "2T+REP",
+                "CCoSp4", "FCSp3", "LSp4", "CSSp2V", "FCCoSp3p4", "StSq3", "ChSq1", "SpSq2", "ChSp1", "USp"],
+    "Pairs": ["3Tw3", "3LzTw2", "3FTh", "3LoTh<", "5ALi4", "5TLi4", "4Li3", "3Li2", "FiDs4", "BiDs3", "PCoSp4",
+              "PSp3", "StSq3", "ChSq1", "3S", "2A+1Eu+2S", "3T+2T", "SpSq2", "ChSp1", "FCCoSp4"],
+}
+
+
+def legacy(text, meta_disc):
+    """ What parse_elt_name used to do: re.findall every expected pattern to check exactly one family matches. """
+    searches = [(p, re.findall(p, text)) for p in element.EXPECTED_PATTERNS[meta_disc]]
+    return [p for (p, s) in searches if s != []]
+
+
+def combined(text, meta_disc):
+    return element.match_families(text, meta_disc)
+
+
+def check_equivalence():
+    for meta_disc, labels in CORPUS.items():
+        for text in labels:
+            assert legacy(text, meta_disc) == combined(text, meta_disc), f"{meta_disc} {text}"
+
+
+def main(repeats=500):
+    logging.disable(logging.CRITICAL)
+    check_equivalence()
+    for meta_disc, labels in CORPUS.items():
+        for name, func in [("legacy", legacy), ("combined", combined)]:
+            elapsed = timeit.timeit(lambda: [func(text, meta_disc) for text in labels], number=repeats)
+            print(f"{meta_disc:<9} {name:<9} {repeats * len(labels) / elapsed:>10,.0f} labels/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+"""
+Microbenchmark: tokenising score rows with score_lexer vs. the per-pass regex pipeline it replaced.
+
+Run from this directory: python bench_score_lexer.py [repeats]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+p_list = [os.path.abspath("../classes/")]
+for path in p_list:
+    if path not in sys.path:
+        sys.path.append(path)
+
+try:
+    import score_lexer
+except ImportError as exc:
+    sys.exit(f"Error: failed to import module ({exc})")
+
+# Non-empty cells of PCS and element rows as they come out of converted protocols (DataRow.raw), covering merged
+# score cells, comma decimals, merged and separate bonus flags, dash columns and OWG-style short rows.
+CORPUS = [
+    ["Skating Skills", 1.0, "8.50 8.75 8.25 8.50 8.75 8.50 8.25 8.75 8.50", 8.54],
+    ["Transitions / Linking Footwork", "1,00", "8,00 8,25 7,75 8,00 8,25 8,00 7,75 8,25 8,00", "8,04"],
+    ["Performance / Execution", 1.6, 7.75, 8.0, 7.5, 7.75, "8.00", 7.75, 7.5, "8.00", 7.75, 7.79],
+    ["Composition / Choreography", "1.60", "8.25 8.50 8.00 - 8.25 8.50 8.00 8.25 8.50", "8.29"],
+    ["Interpretation / Timing", "0.80", "7.75 8.00 7.50 7.75 8.00 - - 7.75 7.50 7.75", "7.75"],
+    ["1 3Lz+3T", "10.10", "1.40 2 2 1 2 2 1 2 2 1", "11.50"],
+    ["2 3F", "5.30 x", "-2.10 -3 -3 -2 -3 -3 -2 -3 -3 -3", "3.20"],
+    ["3 CCoSp4", "3.50", "0.93 2 2 1 2 2 2 1 2 2", "4.43"],
+    ["4 3A<", "6.60x", "-2.80 -3 -3 -3 -3 -2 -3 -3 -3 -3", "3.80"],
+    ["5 StSq3", 3.3, "1.00 2 1 2 2 1 2 2 2 1", 4.3],
+    ["6 2A", "3,30", "0,50 1 1 1 0 1 1 1 1 1", "3,80"],
+    ["7 FCSp4", "3.20 X", "0.50 1 1 1 1 0 1 1 1 1", "3.70"],
+    ["8 3Lo+2T+2Lo", "8,58 x", "0,70 1 1 1 0 1 1 - 1 1", "9,28"],
+    ["9 ChSq1", "2.00", "0.70 1 1 1 1 1 1 1 1 1", "2.70"],
+    ["10 1Lz*", "0.00", "0.00 - - - - - - - - -", "0.00"],
+    ["1 4T", "10.30", "-4.00 -3 -3 -3 -3 -3 -3 -3 -3 -3 - -", "6.30"],
+    ["2 3S", "4.20", "0.70 1 1 1 1 1 1 1 1 1 - -", "4.90"],
+    ["11 CCoSp3p4", "3.00", "0.50 1 1 1 0 1", "3.50"],
+]
+
+
+def legacy_tokens(cells):
+    """ The split / merged-flag / comma passes ScoreRow and PCSRow/GOERow used to make over each row. """
+    split = []
+    for c in cells:
+        split.extend(str(c).split())
+    split = [r.strip() for r in split]
+
+    resplit = []
+    for c in split:
+        if re.search(pattern=re.compile(r"^([\d., ]+) ?x$"), string=str(c)):
+            resplit.extend([re.sub(pattern=re.compile(r"^([\d., ]+) ?x$"), repl=r"\1", string=str(c)), "x"])
+        else:
+            resplit.append(c)
+
+    kinds = []
+    for c in resplit:
+        if re.match(r"^[-\d., \n]+$", c):
+            kinds.append("score")
+        else:
+            kinds.append("other")
+    return [r.replace(",", ".") for r in resplit], kinds
+
+
+def lexer_tokens(cells):
+    tokens = score_lexer.lex(cells)
+    return [t.text for t in tokens], [t.kind for t in tokens]
+
+
+def check_equivalence():
+    for row in CORPUS:
+        legacy_text, legacy_kinds = legacy_tokens(row)
+        lexed_text, lexed_kinds = lexer_tokens(row)
+        assert legacy_text == lexed_text, f"{row}: {legacy_text} != {lexed_text}"
+        assert legacy_kinds == ["score" if k in score_lexer.SCORE_KINDS else "other" for k in lexed_kinds], row
+
+
+def main(repeats=2000):
+    check_equivalence()
+    for name, func in [("legacy", legacy_tokens), ("score_lexer", lexer_tokens)]:
+        elapsed = timeit.timeit(lambda: [func(row) for row in CORPUS], number=repeats)
+        rows_per_sec = repeats * len(CORPUS) / elapsed
+        print(f"{name:<12} {elapsed:8.3f}s for {repeats * len(CORPUS)} rows ({rows_per_sec:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
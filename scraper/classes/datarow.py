@@ -12,10 +12,14 @@ logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message
 logger = logging.getLogger(__name__)
 
 try:
-    None
+    import sheet
+    import score_lexer
+    import diagnostics
 except ImportError as exc:
     sys.exit("Error: failed to import module ({})".format(exc))
 
+tracer = diagnostics.get_tracer(__name__)
+
 NUMBER_AND_NAME_PATTERN = re.compile(r"^\d+\s+\D+")
 DED_TYPE_PATTERN = re.compile(r"[A-Z][^:\-0-9.]*")
 DED_POINT_PATTERN = re.compile(r"(?<!\d)-*\d(?:\.00|\.0)*")
@@ -26,8 +30,13 @@ TRUNC_UNDEDUCTED_VIOLATION = re.compile(r"\n\(([1-3] of 7|[1-4] of 8|[1-4] of 9|
 MAJORITY_VIOLATION = re.compile(r"(?:\b|\n)([A-Z][a-z ]+): \(([4-7] of 7|[5-8] of 8|[5-9] of 9|[6-9] of 10)\)")
 DEDUCTION_VOTE = re.compile(r" -?[1-3][.,]0(?:0)?")
 SPLITTER = re.compile(r"(?i) (?![a-z])")
-MERGED_BONUS_FLAG = re.compile(r"^([\d., ]+) ?x$")
 MERGED_DIGITS = re.compile(r"\d \d")
+TEXT_CELL = re.compile(r"^[A-Za-z\- &/\n:]+$")
+DIGIT_CELL = re.compile(r"^[-\d., \n]+$")
+INT_CELL = re.compile(r"^-?\d{1,2}(\.0|\.00)?(?!\.[1-9]{1,2})$")
+# Non-judge columns in an element row (bv, goe, total) and a PCS row (factor, average)
+GOE_OFFSET, PCS_OFFSET = 3, 2
+HUNDREDTHS_PATTERN = re.compile(r"^([-+]?)(\d*)(?:\.(\d{0,2}))?$")
 
 DED_ALIGNMENT_DIC = {"fall": "falls",
                      "illegal element": "illegal element/movement",
@@ -49,10 +58,8 @@ EXPECTED_DED_TYPES = ["total", "falls", "time violation", "costume failure", "la
 class DataRow:
     def __init__(self, raw_list=None, df=None, row=None, col_min=None):
         if df is not None and row >= 0 and col_min >= 0 and not raw_list:
-            self.raw = []
-            for col in range(col_min, len(df.columns)):
-                if df.iloc[row, col] is not None and not is_nan(df.iloc[row, col]):
-                    self.raw.append(df.iloc[row, col])
+            grid = df if isinstance(df, sheet.SheetGrid) else sheet.SheetGrid(df)
+            self.raw = grid.row_values(row, col_min)
         elif raw_list:
             self.raw = raw_list
         else:
@@ -61,57 +68,32 @@ class DataRow:
 
 
 class ScoreRow(DataRow):
-    def __init__(self, mode, raw_list=None, df=None, row=None, col_min=None):
+    def __init__(self, mode, raw_list=None, df=None, row=None, col_min=None, tokens=None):
         super().__init__(raw_list, df, row, col_min)
-        logger.debug(f"Raw score list is {self.raw}")
+        tracer.debug("Raw score list is %s", self.raw)
 
-        self.split_list = self._split_and_trim()
+        self.tokens = list(tokens) if tokens is not None else score_lexer.lex(self.raw)
+        self.split_list = [t.text for t in self.tokens]
         try:
             self.split_index = self._get_data_start_index(mode)
         except ValueError:
             raise
 
-    def _split_and_trim(self):
-        split = []
-        for c in self.raw:
-            split.extend(str(c).split())
-        return [r.strip() for r in split]
-
     def _get_data_start_index(self, mode):
-        logger.debug(f"Split list is {self.split_list}")
-        check_cell = 0 if mode == "pcs" else 1
-        try:
-            assert not is_digit_cell(self.split_list[check_cell])
-        except AssertionError as ae:
-            raise ValueError(f"{mode} row is fucked, content not as expected: {self.raw}, {ae}")
-
-        self._remove_merged_h2_bonus_flag()
-
-        for i in range(check_cell, len(self.split_list)):
-            if is_digit_cell(self.split_list[i]):
-                return i
-        raise ValueError(f"Row is fucked, couldn't find any numbers in it: {self.raw}")
-
-    def _remove_merged_h2_bonus_flag(self):
-        resplit = []
-        for c in self.split_list:
-            if re.search(pattern=MERGED_BONUS_FLAG, string=str(c)):
-                resplit.extend([re.sub(pattern=MERGED_BONUS_FLAG, repl=r"\1", string=str(c)), "x"])
-            else:
-                resplit.append(c)
-        self.split_list = resplit
+        tracer.debug("Token list is %s", self.tokens)
+        return find_score_start(self.tokens, mode, self.raw)
 
     def _remove_dash_columns(self, mode, row_list, judges=None, case=0, elt_list=None):
         # Context: sometimes protocols include 1-2 random columns of dashes between the end of the goe scores and the
         # total scores. But sometimes unmarked elements are also denoted by a dash. Also I hate this.
-        logger.debug(f"Fed into dash remover: {mode}, {row_list}, {judges}, {case}, {elt_list}")
+        tracer.debug("Fed into dash remover: %s, %s, %s, %s, %s", mode, row_list, judges, case, elt_list)
         if not judges:
             dashless = [x for x in row_list if x != "-"]
             return case, dashless[1:-1]
         else:
-            logger.debug(f"Removing dashes: mode is {mode}, row is {row_list}, judges are {judges}")
+            tracer.debug("Removing dashes: mode is %s, row is %s, judges are %s", mode, row_list, judges)
 
-            offset = 3 if mode == "goe" else 2
+            offset = GOE_OFFSET if mode == "goe" else PCS_OFFSET
 
             test = [x for x in row_list if x != "-"]
             if case == 1 or len(test) == (offset + judges):
@@ -143,7 +125,7 @@ class ScoreRow(DataRow):
             raise PossibleOWGException(self.raw, f"Elt row does not have expected length: {self.raw}, {row_list}")
 
     def _infer_from_previous_element(self, mode, row_list, judges, elt_list):
-        logger.debug(f"Inferring from previous element")
+        tracer.debug("Inferring from previous element")
         try:
             case, dashless = self._remove_dash_columns(mode=mode,
                                                        row_list=row_list,
@@ -173,51 +155,90 @@ class PCSRow(ScoreRow):
                                                      row_list=self.split_list[self.split_index:], elt_list=elt_list)
         except PossibleOWGException:
             raise
-        clean = coerce_to_num_type(list_=[r.replace(",", ".") for r in scores], target_type="decimal")
-        logger.debug(f"Cleaned scores list is {clean}")
+        clean = coerce_to_num_type(list_=scores, target_type="hundredths")
+        tracer.debug("Cleaned scores list is %s", clean)
         return case, clean
 
 
 class GOERow(ScoreRow):
-    def __init__(self, elt_list, judges, raw_list=None, df=None, row=None, col_min=None):
+    def __init__(self, elt_list, judges, raw_list=None, df=None, row=None, col_min=None, layout=None):
+        # A layout has already lexed the row, found the dash-column cases it fits, and completed it if it's a short row
+        if layout is None and df is not None and not col_min:
+            layout = ScoreLayout(df, range(row, row + 1), judges)
+        tokens = layout.tokens.get(row) if layout is not None else None
         try:
-            super().__init__(mode="goe", raw_list=raw_list, df=df, row=row, col_min=col_min)
+            super().__init__(mode="goe", raw_list=raw_list, df=df, row=row, col_min=col_min, tokens=tokens)
         except ValueError:
             raise
         self.row_no = int(self.split_list[0])
         self.row_label = " ".join(self.split_list[1:self.split_index])
-        try:
-            self.case, self.data = self._clean_goe_row(judges, elt_list)
-        except PossibleOWGException:
-            missing_data = DataRow(df=df, row=row-1, col_min=0).raw
-            if len(missing_data) == 1:
-                self.split_list.insert(3, str(missing_data[0]))
-                self.case, self.data = self._clean_goe_row(judges, elt_list)
-            else:
-                raise
-
-    def _clean_goe_row(self, judges, elt_list):
-        temp = self.split_list[self.split_index:]
-        if "x" in temp:
-            self.row_label += " x"
-            temp.remove("x")
-        elif "X" in temp:
+        self.score_texts, has_bonus_flag = goe_score_texts(self.tokens, self.split_index)
+        if has_bonus_flag:
             self.row_label += " x"
-            temp.remove("X")
 
+        case = layout.row_case(row) if layout is not None else None
+        if case is None and layout is not None and row in layout.short_rows:
+            tracer.debug("Row %s is a short OWG row, completing it with the cell above", row)
+            (patched, case) = layout.short_rows[row]
+            self.tokens = list(patched)
+            self.split_list = [t.text for t in self.tokens]
+            self.score_texts, _ = goe_score_texts(self.tokens, self.split_index)
+        # Rows that fit no case, even completed, take the previous element's case or raise PossibleOWGException
+        self.case, self.data = self._clean_goe_row(judges, elt_list, case=case or 0)
+
+    def _clean_goe_row(self, judges, elt_list, case=0):
         try:
-            case, dashless = self._remove_dash_columns(mode="goe", judges=judges, row_list=temp, elt_list=elt_list)
+            case, scores = self._remove_dash_columns(mode="goe", judges=judges, row_list=list(self.score_texts),
+                                                     case=case, elt_list=elt_list)
         except PossibleOWGException:
             raise
-        scores = [r.replace(",", ".") for r in dashless]
-        logger.debug(f"After removing dashes scores are {scores}")
+        tracer.debug("After removing dashes scores are %s", scores)
 
-        one = coerce_to_num_type(list_=scores[0:2], target_type="decimal")
+        one = coerce_to_num_type(list_=scores[0:2], target_type="hundredths")
         two = coerce_to_num_type(list_=scores[2:-1], target_type="int")
-        three = coerce_to_num_type(list_=[scores[-1]], target_type="decimal")
+        three = coerce_to_num_type(list_=[scores[-1]], target_type="hundredths")
         return case, one + two + three
 
 
+class ScoreLayout:
+    """ Column layout of one protocol's element block: judge columns, dash filler columns and total column.
+
+    Every row's score columns are lexed and checked once against each dash-column case ScoreRow._remove_dash_columns
+    knows. GOERow then slices a row that fits some case straight away, with the first case it fits (the one
+    _remove_dash_columns would settle on). A row that fits none is an OWG-style short row if completing it with the
+    cell above, when that is all the line above holds, makes it fit: GOERow then slices the completed row instead.
+    Only rows that fit no case either way fall back to the previous element's case.
+
+    :param df: SheetGrid (or dataframe) holding the protocol
+    :param rows: Range of grid rows making up the element block
+    :param judges: Number of judges on the panel
+    """
+    def __init__(self, df, rows, judges):
+        grid = df if isinstance(df, sheet.SheetGrid) else sheet.SheetGrid(df)
+        self.tokens, self.row_cases, self.short_rows = {}, {}, {}
+
+        for k in rows:
+            tokens = score_lexer.lex(grid.row_values(k, 0))
+            try:
+                start = find_score_start(tokens, "goe")
+            except (ValueError, IndexError):
+                continue
+            self.tokens[k] = tokens
+            self.row_cases[k] = fitting_dash_cases(goe_score_texts(tokens, start)[0], GOE_OFFSET, judges)
+
+            above = grid.row_values(k - 1, 0) if k > 0 and not self.row_cases[k] else []
+            if len(above) == 1:
+                patched = tokens[:3] + score_lexer.lex(above) + tokens[3:]
+                patched_cases = fitting_dash_cases(goe_score_texts(patched, start)[0], GOE_OFFSET, judges)
+                if patched_cases:
+                    self.short_rows[k] = (patched, min(patched_cases))
+
+    def row_case(self, row):
+        """ Returns the first dash-column case the row fits, or None if it fits none. """
+        cases = self.row_cases.get(row)
+        return min(cases) if cases else None
+
+
 class NameRow(DataRow):
     def __init__(self, mode, schema, raw=None, df=None, row=None, col_min=None):
         super().__init__(raw, df, row, col_min)
@@ -274,12 +295,12 @@ class DeductionRow(DataRow):
                 # If find newline in text cell: is neighbouring cell a digit cell? if so, handle both, zip and increment
                 # by two. If not, handle this cell only.
                 this_cell = str(input_row[i]).split("\n")
-                logger.log(5, f"Examining {this_cell}")
+                tracer.log(5, "Examining %s", this_cell)
 
                 if is_text_cell(input_row[i]) and i + 1 < len(input_row) and is_digit_cell(input_row[i + 1]):
-                    logger.log(5, f"{this_cell} PASSED TEST 1 is text cell, >1 before end and neighbours a digit cell")
+                    tracer.log(5, "%s PASSED TEST 1 is text cell, >1 before end and neighbours a digit cell", this_cell)
                     if "\n" in str(input_row[i + 1]):
-                        logger.debug(f"Ded cell {input_row[i]} is case 1: newline with requirement to de-interleave")
+                        tracer.debug("Ded cell %s is case 1: newline with requirement to de-interleave", input_row[i])
                         next_cell = str(input_row[i + 1]).split("\n")
                         if len(this_cell) != len(next_cell):
                             for i in range(0, max(len(this_cell), len(next_cell))):
@@ -296,27 +317,27 @@ class DeductionRow(DataRow):
                         try:
                             assert len(this_cell) == len(next_cell)
                         except AssertionError:
-                            sys.exit(f"Ya deductions cells still don't match girl, {this_cell} vs. {next_cell}")
+                            raise ValueError(f"Ya deductions cells still don't match girl, {this_cell} vs. {next_cell}")
                         output_row.extend([item for pair in zip(this_cell, next_cell) for item in pair])
                         i += 2
-                        logger.log(5, f"WIP list is {output_row}")
+                        tracer.log(5, "WIP list is %s", output_row)
                     else:
-                        logger.log(5, f"Ded cell {input_row[i]} is case 2: newline without requirement to "
-                                      f"de-interleave")
-                        sys.exit(1)
+                        tracer.log(5, "Ded cell %s is case 2: newline without requirement to de-interleave",
+                                   input_row[i])
+                        raise ValueError(f"Unexpected newline in deductions cell {input_row[i]}")
                 else:
-                    logger.log(5, f"{this_cell} FAILED TEST 1: not text cell, <1 before end or doesn't neighbour"
-                                  f" a digit cell")
+                    tracer.log(5, "%s FAILED TEST 1: not text cell, <1 before end or doesn't neighbour a digit cell",
+                               this_cell)
                     filtered_list = [i for i in this_cell if is_digit_cell(i) and is_int(i) or
                                      is_text_cell(i) and is_ded_type_string(i)]
-                    logger.debug(f"Filtered list is {filtered_list}")
+                    tracer.debug("Filtered list is %s", filtered_list)
                     output_row.extend(filtered_list)
                     i += 1
             elif not is_ded_type_string(input_row[i]):
-                logger.log(5, f"{input_row[i]} is not ded-type string, skipping.")
+                tracer.log(5, "%s is not ded-type string, skipping.", input_row[i])
                 i += 1
             else:
-                logger.log(5, f"{input_row[i]} has no newline, not examining, straight append.")
+                tracer.log(5, "%s has no newline, not examining, straight append.", input_row[i])
                 output_row.append(str(input_row[i]))
                 i += 1
         return output_row
@@ -331,16 +352,16 @@ class DeductionRow(DataRow):
         self.raw = clean
 
     def parse_deduction_dictionary(self):
-        logger.info(f"Raw deductions list is {self.raw}")
+        tracer.debug("Raw deductions list is %s", self.raw)
 
         deductions_not_split = True if re.search(pattern=DED_NOT_SPLIT_PATTERN, string=self.raw[0]) else False
         if deductions_not_split:
             self.raw[0] = self.raw[0].replace("Deductions ", "Deductions: ")
-        logger.debug(f"Row after colon insertion is {self.raw}")
+        tracer.debug("Row after colon insertion is %s", self.raw)
 
         self.raw = [re.sub(UNDEDUCTED_VIOLATION, "", str(c)) for c in self.raw]
         self._remove_truncated_undeducted_violations()
-        logger.debug(f"Row after removing undeducted violations is {self.raw}")
+        tracer.debug("Row after removing undeducted violations is %s", self.raw)
 
         str_raw = " ".join([str(x) for x in self.raw])
         res = re.findall(MAJORITY_VIOLATION, str_raw)
@@ -351,32 +372,32 @@ class DeductionRow(DataRow):
                 votes_to_remove = int(r[1][0])
                 str_raw = re.sub(pattern=DEDUCTION_VOTE, repl="", string=str_raw, count=votes_to_remove)
             self.raw = re.split(SPLITTER, str_raw)
-        logger.debug(f"Row after removing violation votes is {self.raw}")
+        tracer.debug("Row after removing violation votes is %s", self.raw)
 
         split_row_1 = self._split_on_colon()
-        logger.debug(f"Row after split on colon {split_row_1}")
+        tracer.debug("Row after split on colon %s", split_row_1)
 
         split_row_2 = self._split_on_newline(split_row_1)
-        logger.debug(f"Row text split on newline is {split_row_2}")
+        tracer.debug("Row text split on newline is %s", split_row_2)
 
         row_less_falls = [re.sub(r"\(\d+\)", "", str(r)) for r in split_row_2]
-        logger.debug(f"Row text after parenthesis removal is {row_less_falls}")
+        tracer.debug("Row text after parenthesis removal is %s", row_less_falls)
 
         row_text = " ".join(row_less_falls)
-        logger.debug(f"Row text after join is {row_text}")
+        tracer.debug("Row text after join is %s", row_text)
 
         row_text = re.sub(DED_TOTAL_PATTERN, r"\1", row_text)
-        logger.debug(f"Row text after total removal is {row_text}")
+        tracer.debug("Row text after total removal is %s", row_text)
 
         ded_words = re.findall(DED_TYPE_PATTERN, row_text)
         ded_digits = re.findall(DED_POINT_PATTERN, row_text)
 
-        logger.debug(f"ded words and digits after regex {ded_words}, {ded_digits}")
+        tracer.debug("ded words and digits after regex %s, %s", ded_words, ded_digits)
 
         # Clean up ded types
         ded_words = [DED_ALIGNMENT_DIC[d.lower().strip()] if d.lower().strip() in DED_ALIGNMENT_DIC
                      else d.lower().strip() for d in ded_words]
-        logger.debug(f"Ded words is now {ded_words}")
+        tracer.debug("Ded words is now %s", ded_words)
         for d in ded_words:
             if d == 'total':
                 del d
@@ -388,20 +409,65 @@ class DeductionRow(DataRow):
         ded_digits = [-1 * int(float(x)) if int(float(x)) > 0 else int(float(x)) for x in ded_digits]
 
         if len(ded_words) != len(ded_digits):
-            sys.exit(f"Lol ya deductions lists are fucked girl: {ded_words} vs. {ded_digits}")
+            raise ValueError(f"Lol ya deductions lists are fucked girl: {ded_words} vs. {ded_digits}")
 
         ded_dic_raw = dict(zip(ded_words, ded_digits))
         ded_dic = {k: v for k, v in ded_dic_raw.items() if int(v) != 0}
-        logger.log(15, f"Returning deductions dic: {ded_dic})")
+        tracer.log(15, "Returning deductions dic: %s)", ded_dic)
         return ded_dic
 
 
+def find_score_start(tokens, mode, raw=None):
+    """ Returns the index of the first score token of a lexed PCS or element row.
+
+    :param tokens: List of score_lexer tokens
+    :param mode: "pcs" or "goe"; element rows start with the element number, so the check starts one token later
+    :param raw: Raw row, for error messages
+    """
+    check_cell = 0 if mode == "pcs" else 1
+    if tokens[check_cell].kind in score_lexer.SCORE_KINDS:
+        raise ValueError(f"{mode} row is fucked, content not as expected: {raw}")
+
+    for i in range(check_cell, len(tokens)):
+        if tokens[i].kind in score_lexer.SCORE_KINDS:
+            return i
+    raise ValueError(f"Row is fucked, couldn't find any numbers in it: {raw}")
+
+
+def goe_score_texts(tokens, split_index):
+    """ Returns the score texts of an element row with its (first) bonus flag taken out, and whether it had one. """
+    scores = tokens[split_index:]
+    bonus_flags = [t for t in scores if t.kind == score_lexer.BONUS]
+    if bonus_flags:
+        scores.remove(bonus_flags[0])
+    return [t.text for t in scores], bool(bonus_flags)
+
+
+def fitting_dash_cases(row_list, offset, judges):
+    """ Returns the dash-column cases of ScoreRow._remove_dash_columns under which row_list has the expected length.
+
+    1: dashes are filler columns and are dropped, 2: dashes are judges' NS marks, 3-5: one to three filler columns of
+    dashes sit just before the total, other dashes are NS marks.
+    """
+    expected = offset + judges
+    cases = []
+    if len([x for x in row_list if x != "-"]) == expected:
+        cases.append(1)
+    with_ns = ["NS" if x == "-" else x for x in row_list]
+    extra = len(with_ns) - expected
+    if extra == 0:
+        cases.append(2)
+    elif 1 <= extra <= 3 and with_ns[-(extra + 1):-1] == ["NS"] * extra:
+        cases.append(extra + 2)
+    return cases
+
+
 def is_text_cell(x):
-    return True if re.match(r"^[A-Za-z\- &/\n:]+$", x) else False
+    return True if TEXT_CELL.match(x) else False
 
 
 def is_digit_cell(x):
-    return True if re.match(r"^[-\d., \n]+$", x) else False
+    return True if DIGIT_CELL.match(x) else False
 
 
 def is_nan(x):
@@ -409,20 +475,37 @@ def is_nan(x):
 
 
 def is_int(x):
-    return True if re.search(r"^-?\d{1,2}(\.0|\.00)?(?!\.[1-9]{1,2})$", x) else False
+    return True if INT_CELL.search(x) else False
 
 
 def is_ded_type_string(x):
     return True if "deductions" not in str(x).lower() and "score" not in str(x).lower() else False
 
 
+def to_hundredths(x):
+    """ Converts a score to an exact integer number of hundredths of a point, e.g. '8.25' -> 825.
+
+    Scores are kept in this form from parsing through to output, so sums and comparisons between them are exact
+    without going through Decimal. Anything with more than two decimal places is rounded half to even.
+    """
+    text = str(x).strip().replace(",", ".")
+    m = HUNDREDTHS_PATTERN.match(text)
+    if m and (m.group(2) or m.group(3)):
+        value = int(m.group(2) or 0) * 100 + int((m.group(3) or "").ljust(2, "0"))
+        return -value if m.group(1) == "-" else value
+    try:
+        return int(dec.Decimal(text).scaleb(2).to_integral_value(rounding=dec.ROUND_HALF_EVEN))
+    except (dec.InvalidOperation, OverflowError):
+        raise ValueError(f"Could not read a score from {x!r}")
+
+
 def coerce_to_num_type(list_, target_type):
     coerced_list = []
     for c in list_:
-        if target_type == "decimal":
+        if target_type == "hundredths":
             try:
-                coerced_list.append(dec.Decimal(str(c)))
-            except (dec.InvalidOperation, ValueError):
+                coerced_list.append(to_hundredths(c))
+            except ValueError:
                 pass
         elif target_type == "float":
             try:
@@ -435,7 +518,7 @@ def coerce_to_num_type(list_, target_type):
             except ValueError:
                 pass
         else:
-            raise ValueError("Please set 'mode' parameter to 'float' or 'int'")
+            raise ValueError("Please set 'mode' parameter to 'hundredths', 'float' or 'int'")
     return coerced_list
 
 
@@ -0,0 +1,97 @@
+import re
+import sys
+import logging
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message)s",
+                    level=logging.DEBUG,
+                    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+try:
+    import datarow
+    import diagnostics
+except ImportError as exc:
+    sys.exit(f"Error: failed to import module ({exc})")
+
+tracer = diagnostics.get_tracer(__name__)
+
+# Tokens of the deductions grammar, tried in order at each position of a cell's text
+DED_TOKEN_PATTERN = re.compile(r"(?P<votes>\(\s*(?P<votes_for>\d+)\s+of\s+(?P<votes_of>\d+)\s*\))"
+                               r"|(?P<count>\(\d+\))"
+                               r"|(?P<points>-?\d+(?:[.,]\d+)?)"
+                               r"|(?P<label>[A-Za-z](?:[A-Za-z &/]*[A-Za-z])?)\s*:?"
+                               r"|(?P<other>\S)")
+
+HEADER, TOTAL = "deductions", "total"
+
+# Deduction type names are shared with datarow, so both parsers recognise the same types
+DED_TYPES = frozenset(datarow.EXPECTED_DED_TYPES) - {TOTAL}
+
+
+def _classify_label(text):
+    """ Returns (kind, deduction type) for a label: kind is "header", "total", "type" or "unknown". """
+    label = text.lower().strip()
+    if label.startswith(HEADER):
+        label = label[len(HEADER):].strip()
+        if not label:
+            return "header", None
+    if label == TOTAL or "deductions" in label or "score" in label:
+        return "total", None
+    label = datarow.DED_ALIGNMENT_DIC.get(label, label)
+    if label in DED_TYPES:
+        return "type", label
+    return "unknown", label
+
+
+def _points(text):
+    value = int(float(text.replace(",", ".")))
+    return -value if value > 0 else value
+
+
+def parse_candidates(rows):
+    """ Parses the deduction rows of a protocol in one pass, returning one interpretation per number of rows read.
+
+    Deductions are laid out as runs of labels and runs of points that pair up in order, so a label cell holding
+    "Falls:\\nTime violation:" next to a cell holding "-1.00\\n-1.00" is read the same way as the labels and points
+    interleaved. Points with no label waiting for them are totals. Fall counts "(2)" are ignored. A label followed by
+    a judges' vote "(k of n)" is a violation that was voted on rather than deducted: it is dropped, and on a majority
+    the k judges' votes that follow are skipped too.
+
+    :param rows: List of raw rows (lists of non-empty cells), starting with the row holding the "Deductions" heading
+    :return: List with, for each i, the {deduction type: points} dict read from rows[0:i+1] (zero deductions left
+             out), or None where those rows contain a deduction type that isn't recognised
+    """
+    candidates = []
+    detail, pending, votes_to_skip, valid = {}, [], 0, True
+    last_label = None
+
+    for row in rows:
+        for cell in row:
+            for m in DED_TOKEN_PATTERN.finditer(str(cell)):
+                kind = m.lastgroup
+                if kind == "label":
+                    label_kind, label = _classify_label(m.group("label"))
+                    if label_kind == "unknown":
+                        tracer.debug("Unrecognised deduction type %s", label)
+                        valid = False
+                    elif label_kind in ("type", "total"):
+                        pending.append(label)
+                    last_label = label_kind
+                    continue
+
+                if kind == "votes":
+                    if last_label in ("type", "total") and pending:
+                        pending.pop()
+                    if 2 * int(m.group("votes_for")) > int(m.group("votes_of")):
+                        votes_to_skip += int(m.group("votes_for"))
+                elif kind == "points":
+                    if votes_to_skip:
+                        votes_to_skip -= 1
+                    elif pending:
+                        label = pending.pop(0)
+                        if label is not None:
+                            detail[label] = _points(m.group("points"))
+                last_label = None
+
+        candidates.append({k: v for k, v in detail.items() if v != 0} if valid else None)
+    return candidates
@@ -0,0 +1,127 @@
+import random
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+TRACE, MORE_INFO = 5, 15
+
+# "verbose": hand every message straight to logging (which only formats it if its level is enabled)
+# "capture": keep each protocol's messages, unformatted, in a ring buffer and only log them if the protocol fails
+# "off": record nothing at all, for production runs where the parsing hot path should do no diagnostic work
+VERBOSE, CAPTURE, OFF = "verbose", "capture", "off"
+
+_config = {"mode": CAPTURE, "ring_size": 500, "sample_rate": 0.0}
+_current = {"buffer": None, "sampled": False}
+
+
+def configure(mode=CAPTURE, ring_size=500, sample_rate=0.0):
+    """ Sets how diagnostics are handled for the rest of the run (call once per process).
+
+    :param mode: VERBOSE, CAPTURE or OFF
+    :param ring_size: Number of most recent messages kept per protocol in capture mode
+    :param sample_rate: Fraction of successfully parsed protocols whose trace is logged anyway, in capture mode
+    """
+    if mode not in (VERBOSE, CAPTURE, OFF):
+        raise ValueError(f"Diagnostics mode must be one of {VERBOSE}, {CAPTURE} or {OFF}, not {mode}")
+    _config.update(mode=mode, ring_size=ring_size, sample_rate=sample_rate)
+
+
+class Lazy:
+    """ Wraps a zero-argument callable so it only runs if the message it is an argument to is actually formatted. """
+    __slots__ = ["func"]
+
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self):
+        return str(self.func())
+
+    def __repr__(self):
+        return repr(self.func())
+
+
+class Tracer:
+    """ Drop-in for the logger.log / logger.debug calls on parsing hot paths.
+
+    Messages take %-style arguments that are only formatted when the message is emitted. Outside a protocol_trace, or
+    in verbose mode, they go straight to logging. Inside a trace in capture mode they are formatted after the fact,
+    so arguments are rendered as they are when the trace is dumped.
+    """
+    __slots__ = ["logger"]
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def log(self, level, msg, *args):
+        mode = _config["mode"]
+        if mode == OFF:
+            return
+        buffer = _current["buffer"]
+        if buffer is not None:
+            buffer.append((self.logger, level, msg, args))
+        elif self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+
+def get_tracer(name):
+    return Tracer(name)
+
+
+def _format(record):
+    (record_logger, record_level, msg, args) = record
+    try:
+        text = msg % args if args else msg
+    except Exception as exc:
+        text = f"{msg} {args} (could not format: {exc})"
+    return f"[{logging.getLevelName(record_level)}] {text}"
+
+
+def _dump(buffer, level, header):
+    logger.log(level, header)
+    for record in buffer:
+        record[0].log(level, _format(record))
+
+
+class Trace:
+    """ Handle on the messages captured by a protocol_trace, still readable once the trace has ended. """
+    __slots__ = ["buffer"]
+
+    def __init__(self, buffer=None):
+        self.buffer = buffer
+
+    def lines(self):
+        """ Returns the captured messages as formatted strings (none unless in capture mode). """
+        return [_format(record) for record in self.buffer] if self.buffer is not None else []
+
+
+@contextmanager
+def protocol_trace(description):
+    """ Collects the diagnostics emitted while parsing one protocol, and logs them only if parsing fails.
+
+    In verbose mode messages are logged as they happen instead, and in off mode nothing is collected.
+
+    :param description: Short description of the protocol, used as the header of a dumped trace
+    :return: Trace of the protocol's messages
+    """
+    if _config["mode"] != CAPTURE:
+        yield Trace()
+        return
+
+    buffer = deque(maxlen=_config["ring_size"])
+    _current["buffer"] = buffer
+    _current["sampled"] = random.random() < _config["sample_rate"]
+    try:
+        yield Trace(buffer)
+    except BaseException:
+        _dump(buffer, logging.ERROR, f"Trace of the last {len(buffer)} messages before {description} failed:")
+        raise
+    else:
+        if _current["sampled"]:
+            _dump(buffer, logging.INFO, f"Sampled trace for {description}:")
+    finally:
+        _current["buffer"] = None
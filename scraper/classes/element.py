@@ -1,12 +1,14 @@
 import logging
 import re
 import sys
-import decimal as dec
 import unittest
+import functools
+from collections import namedtuple
+from types import MappingProxyType
 
 try:
     import datarow
-    import person
+    import diagnostics
 except ImportError as exc:
     sys.exit("Error: failed to import module ({})".format(exc))
 
@@ -14,13 +16,14 @@ logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message
                     level=logging.DEBUG,
                     datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
+tracer = diagnostics.get_tracer(__name__)
 
 # ICE DANCE PATTERNS
 old_choreo_elts = re.compile(r"^((?:Li|Sp)\+TRANS)$")
 pattern_dance = re.compile(r"^(1[A-Z]{2}|2[A-Z]{2}|PSt)([B1-4])?\+kp([YTN]{1,4})(!?\*?)$")
-old_pattern_dance_notation = re.compile(r"^(?i)([1-4]S[1-4])([B1-4])?(\*?)$")
-another_old_pattern_dance_notation = re.compile(r"^(?i)((?:GW|VW|R|CC)[1-2]S(?:[eq]))([B1-4])?"
-                                                r"(?:\+kp([YTN]{3,4}))?(\*?)$")
+old_pattern_dance_notation = re.compile(r"^([1-4]S[1-4])([B1-4])?(\*?)$", re.IGNORECASE)
+another_old_pattern_dance_notation = re.compile(r"^((?:GW|VW|R|CC)[1-2]S(?:[eq]))([B1-4])?"
+                                                r"(?:\+kp([YTN]{3,4}))?(\*?)$", re.IGNORECASE)
 old_twizzles = re.compile(r"^((?:Ch|S|NtMi|FS|BS|Sq)?Tw)([B1-4])?(\*)?$")  # used to be \b
 combo_lifts = re.compile(r"^([A-Za-z]{2,}Li)([B1-4])?(\*)?\+(([A-Za-z]{2,}Li)([B1-4])?|COMBO)(\*)?$")
 step_twizzle_combo = re.compile(r"^([A-Za-z]{1,4}St)([B1-4])?(\*)?\+((?:Ch|S|NtMi|FS|BS)?Tw)([B1-4])?(\*)?$")
@@ -32,7 +35,7 @@ throw_jumps = re.compile(r"^([1-4]?(Eu|T|S|Lo|F|Lz|A|LZ|LO)Th)([!e<*]{0,3})$")
 old_lifts = re.compile(r"^([1-5]?(?:Eu|T|S|Lo|F|Lz|A|LZ|LO)Li)([B1-4])?([!e<*]{0,3})$")
 other_pairs_elts = re.compile(r"^([1-5][A-Za-z]{2,3}(?<!Tw|Th|Eu|Lz|LZ|LO|Lo|Fe)(?<![TSFA])"
                               r"(?<!TwB|TTw|STw|FTw|ATw|ALi|TLi|FLi|SLi|Lze|LZe|LOe|Loe))([B1-4])?(\*?)$")
-indiv_scored_elts = re.compile(r"^(?i)([A-Z]{2,})L([B1-4])?\+[A-Z]{2,}M([B1-4])?$")
+indiv_scored_elts = re.compile(r"^([A-Z]{2,})L([B1-4])?\+[A-Z]{2,}M([B1-4])?$", re.IGNORECASE)
 
 # PAIRS AND SINGLES PATTERNS
 jumps = re.compile(r"\b([1-4]?(Eu|T(?!w)|S|Lo|F|Lz|A|LZ|LO)(?![A-Za-df-z]))([e<*]{0,3})\+?(COMBO|SEQ|REP)?"
@@ -41,7 +44,8 @@ old_single_jump = re.compile(r"\b(Eu|T(?!w)|S|Lo|F|Lz|A|LZ|LO)$")
 
 # CROSS-DISCIPLINE PATTERNS
 spins = re.compile(r"^([A-Za-z]*Sp)(([1-4])p)?([B1-4])?(V([1-5])|V)?(\*?)$")
-other_leveled_elts = re.compile(r"^(?i)([a-z]{2,}(?<!Tw|Sp|Th|Eu|Lz|LZ|LO|Lo)(?<!SpB|SpV)(?<!SpBV))([B1-4]?)(\*?)$")
+other_leveled_elts = re.compile(r"^([a-z]{2,}(?<!Tw|Sp|Th|Eu|Lz|LZ|LO|Lo)(?<!SpB|SpV)(?<!SpBV))([B1-4]?)(\*?)$",
+                                re.IGNORECASE)
 
 
 # Used this to make sure the programme would break when it encountered something it hadn't seen before - can probs
@@ -76,9 +80,14 @@ ELT_TYPES = {"IceDance": {"NtMiSt+STw": "step twizzle combo",
              "Singles": {"St": "steps", "SpSq": "spiral", "ChSq": "choreo", "ChSp": "spiral", r"Sp": "spin"}
              }
 
+# Stems tried longest first (ties in ELT_TYPES order), so a longer stem always wins over one it contains - e.g. "SpSq"
+# is a spiral whatever order the stems above are listed in, never an "Sp" spin
+ELT_TYPE_INDEX = {meta_disc: sorted(types.items(), key=lambda t: -len(t[0]))
+                  for (meta_disc, types) in ELT_TYPES.items()}
+
 
 def _parse_jumps(match_list, dic):
-    logger.debug(f"Match list is {match_list}")
+    tracer.debug("Match list is %s", match_list)
     sorted_tuples = [list(t) for t in zip(*match_list)]
 
     namechecked_jumps = []
@@ -93,7 +102,7 @@ def _parse_jumps(match_list, dic):
     dic["jump_list"] = dict(zip(jump_keys, namechecked_jumps))
 
     dic["call_dic"] = {k + 1: v[2] if v[2] != "" else None for (k, v) in dict(enumerate(match_list)).items()}
-    logger.log(15, f"Unconverted call dic is {dic['call_dic']}")
+    tracer.log(15, "Unconverted call dic is %s", dic['call_dic'])
     for jump in dic["call_dic"]:
         if dic["call_dic"][jump] is not None and "*" in dic["call_dic"][jump]:
             dic["invalid_flag"] = 1
@@ -107,13 +116,13 @@ def _parse_jumps(match_list, dic):
 
 
 def _parse_unleveled_elts(match_list, dic):
-    logger.debug(f"Match list is {match_list}")
+    tracer.debug("Match list is %s", match_list)
     dic["elt_name"] = match_list[0]
     return dic
 
 
 def _parse_new_twists(match_list, dic):
-    logger.debug(f"Match list is {match_list}")
+    tracer.debug("Match list is %s", match_list)
     dic["elt_name"] = match_list[0][0]
     dic["elt_level"] = match_list[0][1]
     dic["invalid_flag"] = 1 if "*" in match_list[0][2] else 0
@@ -125,7 +134,7 @@ def _parse_new_twists(match_list, dic):
 
 
 def _parse_name_level_elts(match_list, dic):
-    logger.debug(f"Match list is {match_list}")
+    tracer.debug("Match list is %s", match_list)
     dic["elt_name"] = match_list[0][0]
     dic["elt_level"] = match_list[0][1]
     dic["invalid_flag"] = 1 if "*" in match_list[0][2] else 0
@@ -204,8 +213,7 @@ def _parse_old_twists(match_list, dic):
 
 
 def _parse_elt_scores(clean_row):
-    bv, sov_goe = dec.Decimal(clean_row[0]), dec.Decimal(clean_row[1])
-    total = dec.Decimal(str(clean_row[-1]))
+    bv, sov_goe, total = clean_row[0], clean_row[1], clean_row[-1]
     for c in clean_row[2:-1]:
         if c != "NS":
             goe = clean_row[2:-1]
@@ -255,13 +263,63 @@ PATTERN_PARSERS = {jumps: _parse_jumps,
                    }
 
 
-def parse_elt_name(text, meta_disc, parsed_dic):
-    keys = PATTERN_PARSERS.keys() & set(EXPECTED_PATTERNS[meta_disc])
-    parser_subset = {k: PATTERN_PARSERS[k] for k in keys}
+def _build_family_matcher(patterns):
+    """ Combines a meta-discipline's element patterns into one regex that tests them all in a single match call.
+
+    Each pattern sits in an optional lookahead at the start of the label, wrapped in a named group, so the groups that
+    capture after one match are exactly the patterns that would have matched on their own. Patterns that aren't anchored
+    to the start (jumps) may match anywhere, as with re.findall.
+
+    :param patterns: List of compiled patterns, as in EXPECTED_PATTERNS
+    :return: Compiled combined pattern, and dict of group name to the pattern it stands for
+    """
+    alternatives, groups = [], {}
+    for i, p in enumerate(patterns):
+        body = p.pattern if p.pattern.startswith("^") else r"[\s\S]*?" + p.pattern
+        if p.flags & re.IGNORECASE:
+            body = f"(?i:{body})"
+        alternatives.append(f"(?:(?=(?P<family_{i}>{body}))|)")
+        groups[f"family_{i}"] = p
+    return re.compile("".join(alternatives)), groups
+
+
+FAMILY_MATCHERS = {meta_disc: _build_family_matcher(patterns) for (meta_disc, patterns) in EXPECTED_PATTERNS.items()}
+
+
+def match_families(text, meta_disc):
+    """ Returns the list of EXPECTED_PATTERNS[meta_disc] patterns that match the element label, in one scan. """
+    (matcher, groups) = FAMILY_MATCHERS[meta_disc]
+    return [groups[g] for (g, v) in matcher.match(text).groupdict().items() if v is not None]
+
+
+# Same codes ("3A", "4T+3T", "CCoSp4", "StSq3"...) recur throughout every season, so parses are memoised
+PARSE_CACHE_SIZE = 8192
+
+EltCodeParse = namedtuple("EltCodeParse", ["fields", "calls_to_impute"])
+
+
+def _freeze(value):
+    return MappingProxyType(dict(value)) if isinstance(value, dict) else value
+
+
+def _thaw(value):
+    return dict(value) if isinstance(value, MappingProxyType) else value
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_elt_code(text, meta_disc):
+    """ Parses an element row label into the fields it encodes, memoised on (label, meta-discipline).
+
+    :param text: Element label as printed in the protocol, e.g. "3Lz+3T<", "CCoSp4 x", "2A e"
+    :param meta_disc: "IceDance", "Singles" or "Pairs"
+    :return: EltCodeParse of a read-only {field: value} mapping (nested dicts read-only too) and the calls that were
+             printed apart from the code and still need imputing, or None
+    """
+    fields = {}
 
     # Check for H2 flag
     if text.endswith(" x"):
-        parsed_dic["h2_bonus_flag"] = 1
+        fields["h2_bonus_flag"] = 1
         text = text[:-2]
 
     # Remove duplicate calls:
@@ -271,31 +329,60 @@ def parse_elt_name(text, meta_disc, parsed_dic):
         text = text[:-3]
 
     # Remove any calls we'll need to impute later
-    logger.debug(f"Text is {text}")
+    tracer.debug("Text is %s", text)
     if " " in text:
         calls_to_impute = text.partition(" ")[2]
         text = text.partition(" ")[0]
     else:
         calls_to_impute = None
 
-    logger.log(15, f"After shortening, parsing {text}")
+    tracer.log(15, "After shortening, parsing %s", text)
 
     # Check only one match
-    searches = [re.findall(p, text) for p in EXPECTED_PATTERNS[meta_disc]]
-    filtered_searches = [s for s in searches if s != []]
-    if not filtered_searches:
+    families = match_families(text, meta_disc)
+    if not families:
         raise ValueError(f"Could not find elt matching expected patterns in {text}")
-    elif len(filtered_searches) > 1:
-        raise ValueError(f"Found multiple parsing possibilities for {text}: {searches}")
+    elif len(families) > 1:
+        raise ValueError(f"Found multiple parsing possibilities for {text}: {[re.findall(p, text) for p in families]}")
+
+    # Use parser specific to the detected pattern
+    pattern = families[0]
+    PATTERN_PARSERS[pattern](match_list=re.findall(pattern, text), dic=fields)
+    return EltCodeParse(MappingProxyType({k: _freeze(v) for k, v in fields.items()}), calls_to_impute)
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def classify(element_name, meta_disc):
+    """ Returns the type of an element ("jump", "spin", "lift", "pattern dance"...), memoised per distinct name.
+
+    Also meant for the analysis scripts, so they get the same element types as the scraper.
 
-    # Use parser specific to each detected pattern, and impute any calls
-    for pattern in parser_subset:
-        if re.findall(pattern, text):
-            return parser_subset[pattern](match_list=re.findall(pattern, text), dic=parsed_dic), calls_to_impute
+    :param element_name: Parsed element name, e.g. "3Lz+3T", "CCoSp", "StSq"
+    :param meta_disc: "IceDance", "Singles" or "Pairs"
+    :return: Element type, or None if the name isn't recognised
+    """
+    for (stem, elt_type) in ELT_TYPE_INDEX[meta_disc]:
+        if stem in element_name:
+            return elt_type
+    if jumps.search(element_name):
+        return "jump"
+    return None
+
+
+def parse_cache_info():
+    """ Returns hit/miss statistics of the element code cache (see functools.lru_cache). """
+    return parse_elt_code.cache_info()
+
+
+def parse_elt_name(text, meta_disc, parsed_dic):
+    record = parse_elt_code(text, meta_disc)
+    # Copy nested dicts back out, since callers go on to edit e.g. the call_dic when imputing calls
+    parsed_dic.update({k: _thaw(v) for k, v in record.fields.items()})
+    return parsed_dic, record.calls_to_impute
 
 
 def _impute_jump_calls(parsed_dic, calls_to_impute):
-    logger.debug(f"Entering impute_jump_calls: {parsed_dic}, {calls_to_impute}")
+    tracer.debug("Entering impute_jump_calls: %s, %s", parsed_dic, calls_to_impute)
     jumps_list = parsed_dic["elt_name"].split("+")
     if parsed_dic["combo_flag"] == 0 and parsed_dic["seq_flag"] == 0:
         if parsed_dic["call_dic"][1]:
@@ -306,7 +393,7 @@ def _impute_jump_calls(parsed_dic, calls_to_impute):
     else:
         edge_calls = [ec for ec in ["e", "!"] if ec in calls_to_impute]
         if len(edge_calls) > 1:
-            sys.exit(f"Err your jumps have multiple edge calls to impute fuck your life: {calls_to_impute}")
+            raise ValueError(f"Err your jumps have multiple edge calls to impute fuck your life: {calls_to_impute}")
         if edge_calls:
             no_edge_jumps, edge_jump_placement = 0, []
             for i in range(0, len(jumps_list)):
@@ -320,13 +407,13 @@ def _impute_jump_calls(parsed_dic, calls_to_impute):
                     parsed_dic["call_dic"][edge_jump_placement[0]] = edge_calls[0]
                 calls_to_impute = calls_to_impute.replace(edge_calls[0], "")
             elif no_edge_jumps == 0:
-                sys.exit(f"Found an edge call but no edge jumps so fuck me I guess {jumps_list}, "
-                         f"{calls_to_impute}")
+                raise ValueError(f"Found an edge call but no edge jumps so fuck me I guess {jumps_list}, "
+                                 f"{calls_to_impute}")
     return parsed_dic, calls_to_impute
 
 
 def _convert_call_dic(call_dic, season):
-    logger.debug(f"Call dic is {call_dic}")
+    tracer.debug("Call dic is %s", call_dic)
     if not call_dic:
         return {}
     converted_dic = {}
@@ -347,49 +434,65 @@ def _convert_call_dic(call_dic, season):
     return converted_dic
 
 
+@functools.lru_cache(maxsize=None)
+def _goe_detail_keys(judges):
+    return ("element_id",) + tuple("J" + str(j).zfill(2) for j in range(1, judges + 1))
+
+
+@functools.lru_cache(maxsize=None)
+def _jump_keys(count):
+    return tuple("jump_" + str(j) for j in range(1, count + 1))
+
+
 class Element:
-    def __init__(self, meta_disc, elt_id, no, name, bv, goe, sov_goe, total, invalid_flag):
-        if sum([bv, sov_goe]).compare(total) != dec.Decimal("0"):
+    # Elements are built by the million, so they're slotted records: per-judge GOEs, jumps and call flags are held as
+    # tuples and only turned into output columns in write_rows
+    __slots__ = ["id", "meta_discipline", "element_label", "element_name", "element_no", "element_type", "bv", "goe",
+                 "sov_goe", "total", "invalid_flag", "case"]
+
+    def __init__(self, meta_disc, elt_id, no, label, name, bv, goe, sov_goe, total, invalid_flag):
+        if bv + sov_goe != total:
             raise ValueError(f"Instantiation of element {name} failed as bv ({bv}) and goe ({sov_goe}) did not sum to "
                              f"total ({total})")
         self.id = elt_id
         self.meta_discipline = meta_disc
+        self.element_label = label
         self.element_name = name
         self.element_no = no
         self.element_type = self._classify_elt()
-        self.bv = dec.Decimal(bv)
-
-        judge_keys = ["J" + str(j).zfill(2) for j in range(1, len(goe) + 1)] if goe else None
-        self.goe_dic = dict(zip(["element_id"] + judge_keys, [self.id] + goe)) if goe else None
-
-        self.sov_goe = dec.Decimal(sov_goe)
-        self.total = dec.Decimal(total)
+        self.bv = bv
+        self.goe = tuple(goe) if goe else None
+        self.sov_goe = sov_goe
+        self.total = total
         self.invalid_flag = invalid_flag
-        logger.log(15, f"Instantiated Element object: {self.id}, no {self.element_no}, {self.element_name} "
-                       f"({self.element_type}), {self.bv} + {self.sov_goe} = {self.total}, "
-                       f"{'invalid' if self.invalid_flag == 1 else 'valid'}")
+        tracer.log(15, "Instantiated Element object: %s, no %s, %s (%s), %s + %s = %s, invalid flag %s", self.id,
+                   self.element_no, self.element_name, self.element_type, self.bv, self.sov_goe, self.total,
+                   self.invalid_flag)
 
     def _classify_elt(self):
-        for key in ELT_TYPES[self.meta_discipline]:
-            if key in self.element_name:
-                return ELT_TYPES[self.meta_discipline][key]
-        if re.search(jumps, self.element_name):
-            return "jump"
-        logger.error(f"Could not find element type for {self.element_name}")
-        sys.exit(f"Could not find element type for {self.element_name}")
+        elt_type = classify(self.element_name, self.meta_discipline)
+        if elt_type is not None:
+            return elt_type
+        raise ValueError(f"Could not find element type for {self.element_name}")
 
     def get_element_dic(self):
-        dic = dict(vars(self))
-        del dic["goe_dic"]
-        del dic["case"]
-        flat_dic = person.flatten_dict(dic)
-        del flat_dic["meta_discipline"]
-        return flat_dic
+        return {"id": self.id, "element_label": self.element_label, "element_name": self.element_name,
+                "element_no": self.element_no,
+                "element_type": self.element_type, "bv": self.bv, "sov_goe": self.sov_goe, "total": self.total,
+                "invalid_flag": self.invalid_flag}
+
+    def write_rows(self, tables, protocol_id):
+        tables["elements"].append(protocol_id=protocol_id, **self.get_element_dic())
+        if self.goe:
+            tables["goe_detail"].append_row(_goe_detail_keys(len(self.goe)), (self.id,) + self.goe)
 
 
 class IceDanceElement(Element):
+    __slots__ = ["elt_1_name", "elt_2_name", "elt_level", "elt_level_lady", "elt_level_man", "elt_1_level",
+                 "elt_2_level", "elt_kps", "interruption_flag"]
+
     def __init__(self, elt_row, season, last_row_dic):
-        logger.log(15, f"Raw elt row is {elt_row.row_label}, {elt_row.data}")
+        tracer.log(15, "Raw elt row is %s, %s", elt_row.row_label, elt_row.data)
         parsed_dic = {"elt_name": None, "elt_1_name": None, "elt_2_name": None,
                       "elt_level": None, "elt_level_lady": None, "elt_level_man": None,
                       "elt_1_level": None, "elt_2_level": None, "elt_kps": None,
@@ -401,11 +504,12 @@ class IceDanceElement(Element):
                                                      parsed_dic=parsed_dic)
         bv, goe, sov_goe, total = _parse_elt_scores(elt_row.data)
 
-        logger.debug(f"Parsed dic is {parsed_dic}")
+        tracer.debug("Parsed dic is %s", parsed_dic)
 
         super().__init__(meta_disc="IceDance",
                          elt_id=last_row_dic["elements"],
                          no=elt_row.row_no,
+                         label=elt_row.row_label,
                          name=parsed_dic["elt_name"],
                          bv=bv,
                          goe=goe,
@@ -425,12 +529,23 @@ class IceDanceElement(Element):
         if calls_to_impute and "*" in calls_to_impute:
             self.invalid_flag = 1
 
-        logger.log(15, f"Attributes for elt {self.element_name} are {self.get_element_dic()}")
+        tracer.log(15, "Attributes for elt %s are %s", self.element_name, diagnostics.Lazy(self.get_element_dic))
+
+    def get_element_dic(self):
+        dic = super().get_element_dic()
+        dic.update({"elt_1_name": self.elt_1_name, "elt_2_name": self.elt_2_name, "elt_level": self.elt_level,
+                    "elt_level_lady": self.elt_level_lady, "elt_level_man": self.elt_level_man,
+                    "elt_1_level": self.elt_1_level, "elt_2_level": self.elt_2_level, "elt_kps": self.elt_kps,
+                    "interruption_flag": self.interruption_flag})
+        return dic
 
 
 class SinglesElement(Element):
+    __slots__ = ["jump_list", "elt_level", "no_positions", "failed_spin_flag", "missed_reqs", "combo_flag", "seq_flag",
+                 "rep_flag", "h2_bonus_flag", "call_flags"]
+
     def __init__(self, elt_row, season, last_row_dic):
-        logger.log(15, f"Raw elt row is {elt_row.row_label}, {elt_row.data}")
+        tracer.log(15, "Raw elt row is %s, %s", elt_row.row_label, elt_row.data)
         parsed_dic = {"elt_name": None, "jump_list": None, "call_dic": None,
                       "elt_level": None, "no_positions": None, "failed_spin_flag": None,
                       "missed_reqs": None, "combo_flag": None, "seq_flag": None, "rep_flag": None,
@@ -442,6 +557,7 @@ class SinglesElement(Element):
         super().__init__(meta_disc="Singles",
                          elt_id=last_row_dic["elements"],
                          no=elt_row.row_no,
+                         label=elt_row.row_label,
                          name=parsed_dic["elt_name"],
                          bv=bv,
                          goe=goe,
@@ -449,7 +565,7 @@ class SinglesElement(Element):
                          total=total,
                          invalid_flag=parsed_dic["invalid_flag"])
 
-        self.jump_list = parsed_dic["jump_list"]
+        self.jump_list = tuple(parsed_dic["jump_list"].values()) if parsed_dic["jump_list"] else None
         self.elt_level = parsed_dic["elt_level"]
         self.no_positions, self.failed_spin_flag = parsed_dic["no_positions"], parsed_dic["failed_spin_flag"]
         self.missed_reqs, self.combo_flag = parsed_dic["missed_reqs"], parsed_dic["combo_flag"]
@@ -459,19 +575,33 @@ class SinglesElement(Element):
         if self.element_type == "jump" and calls_to_impute:
             parsed_dic, calls_to_impute = _impute_jump_calls(parsed_dic=parsed_dic, calls_to_impute=calls_to_impute)
 
-        self.call_dic = _convert_call_dic(parsed_dic["call_dic"], season)
+        self.call_flags = tuple(_convert_call_dic(parsed_dic["call_dic"], season).items())
 
         self.case = elt_row.case
 
         if calls_to_impute and "*" in calls_to_impute:
             self.invalid_flag = 1
 
-        logger.log(15, f"Attributes for elt {self.element_name} are {self.get_element_dic()}")
+        tracer.log(15, "Attributes for elt %s are %s", self.element_name, diagnostics.Lazy(self.get_element_dic))
+
+    def get_element_dic(self):
+        dic = super().get_element_dic()
+        dic.update({"elt_level": self.elt_level, "no_positions": self.no_positions,
+                    "failed_spin_flag": self.failed_spin_flag, "missed_reqs": self.missed_reqs,
+                    "combo_flag": self.combo_flag, "seq_flag": self.seq_flag, "rep_flag": self.rep_flag,
+                    "h2_bonus_flag": self.h2_bonus_flag})
+        if self.jump_list:
+            dic.update(zip(_jump_keys(len(self.jump_list)), self.jump_list))
+        dic.update(self.call_flags)
+        return dic
 
 
 class PairsElement(Element):
+    __slots__ = ["jump_list", "elt_level", "no_positions", "failed_spin_flag", "missed_reqs", "combo_flag", "seq_flag",
+                 "rep_flag", "h2_bonus_flag", "ur_flag", "downgrade_flag", "call_flags"]
+
     def __init__(self, elt_row, season, last_row_dic):
-        logger.log(15, f"Raw elt row is {elt_row.row_label}, {elt_row.data}")
+        tracer.log(15, "Raw elt row is %s, %s", elt_row.row_label, elt_row.data)
         parsed_dic = {"elt_name": None, "jump_list": None, "call_dic": None,
                       "elt_level": None, "no_positions": None, "failed_spin_flag": None,
                       "missed_reqs": None, "combo_flag": None, "seq_flag": None, "rep_flag": None,
@@ -483,18 +613,20 @@ class PairsElement(Element):
         super().__init__(meta_disc="Pairs",
                          elt_id=last_row_dic["elements"],
                          no=elt_row.row_no,
+                         label=elt_row.row_label,
                          name=parsed_dic["elt_name"],
                          bv=bv, goe=goe,
                          sov_goe=sov_goe,
                          total=total,
                          invalid_flag=parsed_dic["invalid_flag"])
 
-        self.jump_list = parsed_dic["jump_list"]
+        self.jump_list = tuple(parsed_dic["jump_list"].values()) if parsed_dic["jump_list"] else None
         self.elt_level = parsed_dic["elt_level"]
         self.no_positions, self.failed_spin_flag = parsed_dic["no_positions"], parsed_dic["failed_spin_flag"]
         self.missed_reqs, self.combo_flag = parsed_dic["missed_reqs"], parsed_dic["combo_flag"]
         self.seq_flag, self.rep_flag = parsed_dic["seq_flag"], parsed_dic["rep_flag"]
 
+        self.ur_flag, self.downgrade_flag = None, None
         if self.element_type == "jump" and calls_to_impute:
             parsed_dic, calls_to_impute = _impute_jump_calls(parsed_dic=parsed_dic, calls_to_impute=calls_to_impute)
         else:
@@ -503,14 +635,49 @@ class PairsElement(Element):
 
         self.h2_bonus_flag = parsed_dic["h2_bonus_flag"]
 
-        self.call_dic = _convert_call_dic(parsed_dic["call_dic"], season)
+        self.call_flags = tuple(_convert_call_dic(parsed_dic["call_dic"], season).items())
 
         self.case = elt_row.case
 
         if calls_to_impute and "*" in calls_to_impute:
             self.invalid_flag = 1
 
-        logger.log(15, f"Attributes for elt {self.element_name} are {self.get_element_dic()}")
+        tracer.log(15, "Attributes for elt %s are %s", self.element_name, diagnostics.Lazy(self.get_element_dic))
+
+    def get_element_dic(self):
+        dic = super().get_element_dic()
+        dic.update({"elt_level": self.elt_level, "no_positions": self.no_positions,
+                    "failed_spin_flag": self.failed_spin_flag, "missed_reqs": self.missed_reqs,
+                    "combo_flag": self.combo_flag, "seq_flag": self.seq_flag, "rep_flag": self.rep_flag,
+                    "h2_bonus_flag": self.h2_bonus_flag})
+        if self.ur_flag is not None:
+            dic.update({"ur_flag": self.ur_flag, "downgrade_flag": self.downgrade_flag})
+        if self.jump_list:
+            dic.update(zip(_jump_keys(len(self.jump_list)), self.jump_list))
+        dic.update(self.call_flags)
+        return dic
+
+
+ELEMENT_CLASSES = {"IceDance": IceDanceElement, "Singles": SinglesElement, "Pairs": PairsElement}
+
+# Columns of the elements table that don't come from the row label
+NON_LABEL_COLUMNS = {"id", "element_no", "element_label", "bv", "sov_goe", "total"}
+
+LabelRow = namedtuple("LabelRow", ["row_label", "data", "row_no", "case"])
+
+
+def derive_label_columns(label, meta_disc, season):
+    """ Re-derives the elements columns that come from the stored row label alone (name, type, level, calls, flags,
+    jumps), exactly as parsing the protocol would have.
+
+    :param label: Element row label as stored in elements.element_label, e.g. "3Lz+3T< x"
+    :param meta_disc: "IceDance", "Singles" or "Pairs"
+    :param season: Season of the segment, e.g. "sb2009", which decides how underrotation calls are read
+    :return: Dict of column name to value
+    """
+    elt = ELEMENT_CLASSES[meta_disc](LabelRow(row_label=label, data=(0, 0, 0), row_no=None, case=None), season,
+                                     {"elements": None})
+    return {k: v for (k, v) in elt.get_element_dic().items() if k not in NON_LABEL_COLUMNS}
 
 
 class ElementTests(unittest.TestCase):
@@ -112,7 +112,6 @@ class ScoredSegment(Segment):
     def __init__(self, name_to_parse, discipline, id_dic):
         sd = datetime.strptime(name_to_parse.partition("_")[0], "%y%m%d").date()
         y = sd.year
-        self.protocol_list = []
 
         try:
             seg = _parse_segment(name_to_parse, discipline)
@@ -130,10 +129,7 @@ class ScoredSegment(Segment):
         logger.debug(f"Instantiated ScoredSegment object with the following attributes {self.get_segment_dic()}")
 
     def get_segment_dic(self):
-        dic = dict(vars(self))
-        if "protocol_list" in dic:
-            del dic["protocol_list"]
-        return dic
+        return dict(vars(self))
 
 
 if __name__ == "__main__":
@@ -47,6 +47,115 @@ def flatten_dict(init_dict):
     return res_dict
 
 
+_MISSING = object()
+
+
+class IdentityIndex:
+    """ Hash index of the people and teams already in the competitors (or officials) table, loaded in one query.
+
+    Identities first seen in the current batch are registered as pending, pointing at their objects (which are still
+    to be written out), and become stored once their batch is committed. Federations newly observed for stored
+    identities are applied to the index straight away and queued as (id, field, federation) updates, to be written
+    back with the next batch instead of one UPDATE and commit per sighting.
+
+    Every federation change, to a stored identity or to a pending object's fed_dic, is logged so that rollback can undo
+    those made by a protocol that is then quarantined.
+    """
+    def __init__(self, mode, cursor=None):
+        self.mode = mode
+        self.stored = {}
+        self.pending = {}
+        self.fed_updates = []
+        self.undo_log = []
+        if cursor is not None and db_builder.check_table_exists(mode, cursor):
+            self._load(cursor)
+
+    def _load(self, cursor):
+        columns = db_builder.get_table_columns(self.mode, cursor)
+        fed_columns = [c for c in columns if c.endswith("_fed")]
+        # Teams are looked up on competitor_name, people on tight_full_name
+        name_columns = [c for c in ["tight_full_name", "competitor_name", "competitor_type"] if c in columns]
+        cursor.execute(sql.SQL("SELECT {} FROM {} ORDER BY id;").format(
+            sql.SQL(", ").join(sql.Identifier(c) for c in ["id"] + name_columns + fed_columns),
+            sql.Identifier(self.mode)))
+        for row in cursor.fetchall():
+            record = dict(zip(["id"] + name_columns + fed_columns, row))
+            feds = {c: record[c] for c in fed_columns}
+            keys = []
+            if record.get("tight_full_name") is not None:
+                keys.append(("person", record["tight_full_name"]))
+            if record.get("competitor_type") == "team":
+                keys.append(("team", record["competitor_name"]))
+            for key in keys:
+                if key in self.stored:
+                    logger.error(f"Found several {self.mode} rows for {key[1]}, using id {self.stored[key][0]}")
+                    continue
+                self.stored[key] = [int(record["id"]), feds]
+        logger.info(f"Loaded {len(self.stored)} {self.mode} identities")
+
+    def find_stored(self, key):
+        """ Returns the id of a stored identity, or None. """
+        entry = self.stored.get(key)
+        return entry[0] if entry is not None else None
+
+    def find_pending(self, key):
+        """ Returns the object of an identity first seen in the current batch, or None. """
+        return self.pending.get(key)
+
+    def register(self, key, obj):
+        self.pending[key] = obj
+
+    def set_fed(self, fed_dic, field, fed):
+        """ Sets fed_dic[field] (of a stored identity or a pending object), logging the change for rollback. """
+        self.undo_log.append((fed_dic, field, fed_dic.get(field, _MISSING)))
+        fed_dic[field] = fed
+
+    def observe_fed(self, key, field, fed, replace_isu=True):
+        """ Records a federation seen for a stored identity, if the field is empty or (replace_isu) just says ISU. """
+        entry = self.stored[key]
+        current = entry[1].get(field)
+        if current is None or (replace_isu and current == "ISU" and fed != "ISU"):
+            self.set_fed(entry[1], field, fed)
+            self.fed_updates.append((entry[0], field, fed))
+
+    def pop_fed_updates(self):
+        fed_updates, self.fed_updates, self.undo_log = self.fed_updates, [], []
+        return fed_updates
+
+    def commit_pending(self):
+        """ Moves the identities registered since the last call to stored, once their batch has been committed. """
+        for key, obj in self.pending.items():
+            self.stored[key] = [int(obj.id), dict(obj.fed_dic)]
+        self.pending = {}
+
+    def clear_pending(self):
+        self.pending = {}
+
+    def mark(self):
+        """ Returns a savepoint that rollback can return the index to, e.g. before parsing a protocol. """
+        return len(self.pending), len(self.fed_updates), len(self.undo_log)
+
+    def rollback(self, mark):
+        (pending_count, update_count, undo_count) = mark
+        for key in list(self.pending)[pending_count:]:
+            del self.pending[key]
+        for (fed_dic, field, previous) in reversed(self.undo_log[undo_count:]):
+            if previous is _MISSING:
+                del fed_dic[field]
+            else:
+                fed_dic[field] = previous
+        del self.fed_updates[update_count:]
+        del self.undo_log[undo_count:]
+
+
+def get_identity_index(conn_dic, mode):
+    """ Returns the run's IdentityIndex for mode ("competitors" or "officials"), loading it on first use. """
+    indices = conn_dic.setdefault("identities", {})
+    if mode not in indices:
+        indices[mode] = IdentityIndex(mode, conn_dic["cursor"])
+    return indices[mode]
+
+
 class Person:
     def __init__(self, name_string, person_list, last_row_dic, season_observed, fed_observed, mode, conn_dic):
 
@@ -62,30 +171,21 @@ class Person:
 
     def _check_and_complete_record(self, person_list, last_row_dic, season_observed, mode, conn_dic):
         field = season_observed + "_fed"
-        if db_builder.check_table_exists(mode, conn_dic["cursor"]):
-            table = sql.Identifier(mode)
-            conn_dic["cursor"].execute(sql.SQL("SELECT id, {} FROM {} WHERE tight_full_name=%s;")
-                                       .format(sql.Identifier(field), table),
-                                       (self.tight_full_name,))
-            prev_id = conn_dic["cursor"].fetchall()
-            try:
-                assert len(prev_id) in [0, 1]
-            except AssertionError as ae:
-                logger.error(f"prev_id returned {prev_id}: {ae}")
-
-            if prev_id:
-                if prev_id[0][1] is None or (prev_id[0][1] == "ISU" and self.fed_dic[field] != "ISU"):
-                    query = sql.SQL("UPDATE {} SET {} = %s WHERE id = %s;").format(table, sql.Identifier(field))
-                    conn_dic["cursor"].execute(query, (self.fed_dic[field], prev_id[0][0]))
-                    conn_dic["conn"].commit()
-                return int(prev_id[0][0])
-
-        for person in person_list:
-            if isinstance(person, Person) and person.tight_full_name == self.tight_full_name:
-                if field not in person.fed_dic or (person.fed_dic[field] == "ISU" and self.fed_dic[field] != "ISU"):
-                    person.fed_dic[season_observed + "_fed"] = self.fed_dic[season_observed + "_fed"]
-                return int(person.id)
+        index = get_identity_index(conn_dic, mode)
+        key = ("person", self.tight_full_name)
+
+        prev_id = index.find_stored(key)
+        if prev_id is not None:
+            index.observe_fed(key, field, self.fed_dic[field])
+            return prev_id
 
+        person = index.find_pending(key)
+        if person is not None:
+            if field not in person.fed_dic or (person.fed_dic[field] == "ISU" and self.fed_dic[field] != "ISU"):
+                index.set_fed(person.fed_dic, field, self.fed_dic[field])
+            return int(person.id)
+
+        index.register(key, self)
         person_list.append(self)
         last_row_dic[mode] += 1
         return int(last_row_dic[mode] - 1)
@@ -126,7 +226,7 @@ class Team:
                               season_observed=season_observed, fed_observed=name_row.data[2], mode="competitors",
                               conn_dic=conn_dic)
         except IndexError as ie:
-            sys.exit(f"Index error on one of {names}, {name_row.data}: {ie}")
+            raise ValueError(f"Index error on one of {names}, {name_row.data}: {ie}")
 
         self.fed_dic = {season_observed + "_fed": self.lady.fed_dic[season_observed + "_fed"]}
 
@@ -143,32 +243,21 @@ class Team:
 
     def _check_and_complete_record(self, competitor_list, last_row_dic, season_observed, conn_dic):
         field = season_observed + "_fed"
-        if db_builder.check_table_exists("competitors", conn_dic["cursor"]):
-            table = sql.Identifier("competitors")
-            conn_dic["cursor"].execute(sql.SQL("SELECT id, {} FROM {} WHERE competitor_name=%s;")
-                                       .format(sql.Identifier(field), table),
-                                       (self.team_name,))
-            prev_id = conn_dic["cursor"].fetchall()
-            try:
-                assert len(prev_id) in [0, 1]
-            except AssertionError as ae:
-                logger.error(f"prev_id returned {prev_id}: {ae}")
-
-            if prev_id:
-                if prev_id[0][1] is None:
-                    query = sql.SQL("UPDATE {} SET {} = %s WHERE id = %s;").format(table, sql.Identifier(field))
-                    conn_dic["cursor"].execute(query, (self.fed_dic[field], prev_id[0][0]))
-                    conn_dic["conn"].commit()
-                return int(prev_id[0][0])
-
-        for c in competitor_list:
-            if isinstance(c, Team) and c.team_name == self.team_name:
-                self.id = c.id
-                c.fed_dic[season_observed + "_fed"] = self.fed_dic[season_observed + "_fed"]
-                if field not in c.fed_dic:
-                    c.fed_dic[season_observed + "_fed"] = self.fed_dic[season_observed + "_fed"]
-                return int(c.id)
+        index = get_identity_index(conn_dic, "competitors")
+        key = ("team", self.team_name)
+
+        prev_id = index.find_stored(key)
+        if prev_id is not None:
+            index.observe_fed(key, field, self.fed_dic[field], replace_isu=False)
+            return prev_id
+
+        c = index.find_pending(key)
+        if c is not None:
+            self.id = c.id
+            index.set_fed(c.fed_dic, field, self.fed_dic[field])
+            return int(c.id)
 
+        index.register(key, self)
         competitor_list.append(self)
         last_row_dic["competitors"] += 1
         return int(last_row_dic["competitors"] - 1)
@@ -254,10 +343,12 @@ class PersonTests(unittest.TestCase):
         cur = conn.cursor()
         lr = {"officials": 34}
         lof = []
-        o1 = Official("Mrs. Akiko SUZUKI", lr, lof, "sb2013", "JPN", {"conn": conn, "cursor": cur})
-        o2 = Official("Mr Nobunari ODA", lr, lof, "sb2013", "JPN", {"conn": conn, "cursor": cur})
-        o3 = Official("Ms Nobunari ODA", lr, lof, "sb2014", "JPN", {"conn": conn, "cursor": cur})
-        logger.debug(f"Next id assigned will be {lr['officials']}", {"conn": conn, "cursor": cur})
+        # The identity index lives in conn_dic, so the same one must be passed throughout, as in a run
+        conn_dic = {"conn": conn, "cursor": cur}
+        o1 = Official("Mrs. Akiko SUZUKI", lr, lof, "sb2013", "JPN", conn_dic)
+        o2 = Official("Mr Nobunari ODA", lr, lof, "sb2013", "JPN", conn_dic)
+        o3 = Official("Ms Nobunari ODA", lr, lof, "sb2014", "JPN", conn_dic)
+        logger.debug(f"Next id assigned will be {lr['officials']}")
         logger.debug(dict(vars(o2)))
         assert len(lof) == 2
         assert lr["officials"] == 36
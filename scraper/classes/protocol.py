@@ -1,7 +1,6 @@
 import sys
 import re
 import logging
-import decimal as dec
 import unicodedata
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message)s",
@@ -14,22 +13,41 @@ try:
     import person
     import datarow
     import element
+    import sheet
+    import deduction_parser
+    import diagnostics
 except ImportError as exc:
     sys.exit(f"Error: failed to import module ({exc})")
 
+tracer = diagnostics.get_tracer(__name__)
+
 NAME_LIKE_PATTERN = re.compile(r"[A-Z]{2,}")
+JUDGE_HEADER_PATTERN = re.compile(r"^J(\d{1,2})$")
+
+
+def judges_in_header(header):
+    """ Returns n if the cells of an elements table heading row label judge columns J1 to Jn, otherwise None. """
+    numbers = [int(m.group(1)) for cell in header for token in str(cell).split()
+               for m in [JUDGE_HEADER_PATTERN.match(token)] if m]
+    if numbers and sorted(numbers) == list(range(1, len(numbers) + 1)):
+        return len(numbers)
+    return None
 
 
 class Protocol:
-    def __init__(self, df, protocol_coordinates, segment, skater_list, last_row_dic, conn_dic):
+    def __init__(self, df, protocol_coordinates, segment, skater_list, last_row_dic, conn_dic, tables, anchors=None,
+                 judge_counts=None):
         (row_start, row_end) = protocol_coordinates
+        self.tables = tables
+        self.anchors = anchors if anchors is not None else sheet.AnchorIndex(df)
+        self.judge_counts = judge_counts if judge_counts is not None else {}
         schema = self._find_name_row_schema(segment)
 
         name_row = self._find_name_row(df=df,
                                        anchor_coords=(row_start, 0),
                                        size_of_sweep=(1, 4, 3),
                                        schema=schema)
-        logger.debug(f"Name row is {name_row.data}")
+        tracer.debug("Name row is %s", name_row.data)
 
         self.id = last_row_dic["protocols"]
         last_row_dic["protocols"] += 1
@@ -41,27 +59,30 @@ class Protocol:
         self.elt_list_ends = None
 
         self.pcs_start_row = None
-        self.pcs_av_list = []
-        self.pcs_detail_list = []
 
         self.number_of_judges = self.count_judges(df)
+        self.judge_keys = ["J" + str(j).zfill(2) for j in range(1, self.number_of_judges + 1)]
 
         self.skater = CONSTRUCTOR_DIC[segment.discipline]["competitor"](name_row, skater_list, last_row_dic,
                                                                         self.season, conn_dic)
 
         self.starting_number = int(name_row.data[3]) if schema == "new" else None
-        self.tss_total = dec.Decimal(str(name_row.data[4])) if schema == "new" else dec.Decimal(str(name_row.data[3]))
-        self.tes_total = dec.Decimal(str(name_row.data[5])) if schema == "new" else dec.Decimal(str(name_row.data[4]))
-        self.pcs_total = dec.Decimal(str(name_row.data[6])) if schema == "new" else dec.Decimal(str(name_row.data[5]))
-        logger.log(15, f"Scores are tss {self.tss_total}, tes {self.tes_total}, pcs {self.pcs_total}")
-        self.deductions = dec.Decimal(self.tss_total - self.tes_total - self.pcs_total)
+        # Scores are held in integer hundredths (see datarow.to_hundredths)
+        offset = 1 if schema == "new" else 0
+        self.tss_total = datarow.to_hundredths(name_row.data[3 + offset])
+        self.tes_total = datarow.to_hundredths(name_row.data[4 + offset])
+        self.pcs_total = datarow.to_hundredths(name_row.data[5 + offset])
+        tracer.log(15, "Scores are tss %s, tes %s, pcs %s (hundredths)", self.tss_total, self.tes_total,
+                   self.pcs_total)
+        self.deductions = self.tss_total - self.tes_total - self.pcs_total
 
         self.elts = []
 
         self.ded_detail = {}
         name = self.skater.team_name if isinstance(self.skater, person.Team) else self.skater.full_name
-        logger.log(15, f"Instantiated Skate object for {unicodedata.normalize('NFKD', name).encode('ascii','ignore')}"
-                       f" with total score {self.tss_total} and starting no. {self.starting_number}")
+        tracer.log(15, "Instantiated Skate object for %s with total score %s and starting no. %s",
+                   diagnostics.Lazy(lambda: unicodedata.normalize('NFKD', name).encode('ascii', 'ignore')),
+                   self.tss_total, self.starting_number)
 
     def _find_name_row(self, df, anchor_coords, size_of_sweep, schema):
         (row, col) = anchor_coords
@@ -75,10 +96,10 @@ class Protocol:
         (first_row_to_sweep, last_row_to_sweep, last_col_to_sweep) = size_of_sweep
         for r in range(row + first_row_to_sweep, row + last_row_to_sweep + 1):
             for c in range(0, col + last_col_to_sweep + 1):
-                if re.search(NAME_LIKE_PATTERN, str(df.iloc[r, c])):
+                if re.search(NAME_LIKE_PATTERN, str(df.cell(r, c))):
                     return datarow.NameRow(mode="single line", df=df, row=r, col_min=0, schema=schema)
 
-        sys.exit(f"Could not find name row that matched expected pattern in sweep from {anchor_coords}")
+        raise ValueError(f"Could not find name row that matched expected pattern in sweep from {anchor_coords}")
 
     def _find_name_row_schema(self, segment):
         if int(segment.season[2:]) >= 2009 or (int(segment.season[2:]) == 2008 and segment.name in ['WTT', 'WC']):
@@ -88,45 +109,53 @@ class Protocol:
 
     def _get_elt_list_location(self, df, i, j):
         # Avoids scanning more rows than needed/false positives.
-        if df.iloc[i + 1, j] or df.iloc[i + 1, j - 1]:
+        if df.cell(i + 1, j) or df.cell(i + 1, j - 1):
             increment = 1
         else:
             increment = 2
 
         # Get number of elements in the programme (e.g. when some are invalid there might be 14 instead of 13)
         self.elt_list_starts = i + increment
-        for row in range(self.elt_list_starts, df.shape[0] + 1):
-            concat_row = " ".join([str(cell) for cell in datarow.DataRow(df=df, row=row, col_min=0).raw])
-            if "Program Components" in concat_row:
-                break
-        self.elt_list_ends = row if row == df.shape[0] else row - 1
+        pcs_row = self.anchors.next_row("Program Components", self.elt_list_starts)
+        self.elt_list_ends = df.shape[0] if pcs_row is None else pcs_row - 1
 
     def count_judges(self, df):
         """ Sets the number of judges observed on this sheet of the spreadsheet.
 
-        Scans columns, then rows to go faster since string usually found in first couple of columns. (You'd think the
-        following bit only needs to be done once per WB, but no -- sometimes judges disappear mid-segment).
+        Read from the J1..Jn columns of the elements table heading, and cached in judge_counts against that heading, so
+        it's only worked out again when the heading changes (judges can disappear mid-segment). Layouts without judge
+        labels count the scores of the protocol's first Skating Skills row instead, every time, since an unlabelled
+        heading doesn't change when a judge drops out.
+
+        A judge listed in the heading but marked "-" throughout is counted, where the Skating Skills count leaves them
+        out: their dashes are then read as NS marks.
 
-        :param df: Dataframe containing raw input from spreedsheet sheet.
+        :param df: SheetGrid containing raw input from spreedsheet sheet.
         :return: Integer number of judges.
         """
-        # Get first "Skating skills" scorelist and clean it (e.g. multiple scores in same cell, comma decimals, etc.)
-        counter = None
-        for j in self.col_range:
-            for i in self.row_range:
-                if "Skating Skills" in str(df.iloc[i, j]):
-                    self.pcs_start_row = i
-                    try:
-                        counter = datarow.PCSRow(df=df, row=i, col_min=j).data
-                    except ValueError:
-                        raise
-                    break
-            if counter:
-                break
-        no_judges = len(counter)
-        logger.debug(f"Found {no_judges} judges in current protocol")
+        hits = self.anchors.find("Elements", rows=self.row_range, cols=self.col_range)
+        header = tuple(df.row_values(hits[0][0])) if hits else None
+        if header is not None and header not in self.judge_counts:
+            self.judge_counts[header] = judges_in_header(header)
+        no_judges = self.judge_counts[header] if header is not None else None
+
+        if no_judges is None:
+            no_judges = self._count_pcs_judges(df)
+        tracer.debug("Found %s judges in current protocol", no_judges)
         return no_judges
 
+    def _count_pcs_judges(self, df):
+        # Takes the first hit in column-major order, since the string is usually found in the first couple of columns.
+        # Gets first "Skating skills" scorelist and cleans it (e.g. multiple scores in same cell, comma decimals, etc.)
+        hits = self.anchors.find("Skating Skills", rows=self.row_range, cols=self.col_range)
+        if not hits:
+            raise ValueError(f"Could not find Skating Skills row between rows {self.row_range.start} and "
+                             f"{self.row_range.stop - 1}")
+        (i, j) = min(hits, key=lambda coords: (coords[1], coords[0]))
+        self.pcs_start_row = i
+        counter = datarow.PCSRow(df=df, row=i, col_min=j).data
+        return len(counter)
+
     def parse_pcs_table(self, df, i, j, last_row_dic):
         num_components = 4 if self.discipline == "IceDance" and int(self.season[4:]) < 10 else 5
 
@@ -136,27 +165,33 @@ class Protocol:
             component.id = last_row_dic["pcs_averages"]
             last_row_dic["pcs_averages"] += 1
 
-            comp_dic = {"id": component.id, "component": component.row_label, "component_factor": component.data[0],
-                        "trimmed_av_cs": component.data[-1], "protocol_id": self.id}
-            logger.log(15, f"Logging component row as {comp_dic}")
-            self.pcs_av_list.append(comp_dic)
+            self.tables["pcs_averages"].append(id=component.id, component=component.row_label,
+                                               component_factor=component.data[0], trimmed_av_cs=component.data[-1],
+                                               protocol_id=self.id)
+            tracer.log(15, "Logging component row as %s, %s", component.row_label, component.data)
 
-            judge_keys = ["J" + str(j).zfill(2) for j in range(1, self.number_of_judges + 1)]
-            self.pcs_detail_list.append(dict(zip(["pcs_avg_id"] + judge_keys, [component.id] + component.data[1:-1])))
+            self.tables["pcs_detail"].append_row(["pcs_avg_id"] + self.judge_keys,
+                                                 [component.id] + component.data[1:-1])
 
         name = self.skater.team_name if isinstance(self.skater, person.Team) else self.skater.full_name
-        logger.debug(f"Loaded pcs table for {unicodedata.normalize('NFKD', name).encode('ascii','ignore')}")
+        tracer.debug("Loaded pcs table for %s",
+                     diagnostics.Lazy(lambda: unicodedata.normalize('NFKD', name).encode('ascii', 'ignore')))
 
     def parse_tes_table(self, df, i, j, last_row_dic):
         self._get_elt_list_location(df, i, j)
-        for k in range(self.elt_list_starts, self.elt_list_ends):
+        elt_rows = range(self.elt_list_starts, self.elt_list_ends)
+        layout = datarow.ScoreLayout(df, elt_rows, self.number_of_judges)
+        for k in elt_rows:
             try:
-                elt_row = datarow.GOERow(elt_list=self.elts, judges=self.number_of_judges, df=df, row=k, col_min=0)
+                elt_row = datarow.GOERow(elt_list=self.elts, judges=self.number_of_judges, df=df, row=k, col_min=0,
+                                         layout=layout)
             except ValueError:
                 raise
-            logger.debug(f"Elt row is {elt_row.row_label}, {elt_row.data}")
+            tracer.debug("Elt row is %s, %s", elt_row.row_label, elt_row.data)
 
-            self.elts.append(CONSTRUCTOR_DIC[self.discipline]["elt"](elt_row, self.season, last_row_dic))
+            elt = CONSTRUCTOR_DIC[self.discipline]["elt"](elt_row, self.season, last_row_dic)
+            elt.write_rows(self.tables, protocol_id=self.id)
+            self.elts.append(elt)
             last_row_dic["elements"] += 1
 
     def parse_deductions(self, df, i, j, segment):
@@ -172,13 +207,13 @@ class Protocol:
         :param segment:
         :return:
         """
-        logger.log(15, f"Total deductions for this skate known to be {self.deductions.quantize(dec.Decimal('0'))}. "
-                       f"Attempting to match...")
+        tracer.log(15, "Total deductions for this skate known to be %.2f. Attempting to match...",
+                   self.deductions / 100)
 
-        if self.deductions.compare(dec.Decimal('0')) == dec.Decimal('0'):
-            logger.debug(f"No deductions here, move along")
+        if self.deductions == 0:
+            tracer.debug("No deductions here, move along")
         else:
-            logger.debug(f"RIP so we're doing this huh")
+            tracer.debug("RIP so we're doing this huh")
 
             # Older protocols present deductions over two rows, with two different models: total at end of top row or
             # at end of bottom row
@@ -186,47 +221,25 @@ class Protocol:
             is_torino_prot = (segment.year == 2006 and segment.name == "OWG")
             is_old_ded_format = True if segment.year < 2005 or is_h2_sb2004_prot or is_torino_prot else False
 
-            try:
-                ded_dic = datarow.DeductionRow(df=df, row=i, col_min=j).ded_detail
-            except ValueError as ve:
-                sys.exit(f"Encountered unknown deduction in protocol for {dict(vars(self.skater))}: {ve}")
-            print(ded_dic)
-            if sum(ded_dic.values()) == int(self.deductions):
-                self.ded_detail = ded_dic
-                return
-
-            row_1 = datarow.DataRow(df=df, row=i, col_min=j).raw
-            row_2 = datarow.DataRow(df=df, row=i + 1, col_min=j).raw
-            try:
-                ded_dic_2 = datarow.DeductionRow(raw=row_1 + row_2).ded_detail
-            except ValueError as ve:
-                sys.exit(f"Encountered unknown deduction in protocol for {dict(vars(self.skater))}: {ve} "
-                         f"(on case 2, prev tried {ded_dic})")
-            if is_old_ded_format and sum(ded_dic_2.values()) == int(self.deductions):
-                self.ded_detail = ded_dic_2
-                return
-
-            row_3 = datarow.DataRow(df=df, row=i + 2, col_min=j).raw
-            try:
-                ded_dic_3 = datarow.DeductionRow(raw=row_1 + row_2 + row_3).ded_detail
-            except ValueError as ve:
-                sys.exit(f"Encountered unknown deduction in protocol for {dict(vars(self.skater))}: {ve} "
-                         f"(on case 3, prev tried {ded_dic_2})")
-            if is_old_ded_format and sum(ded_dic_3.values()) == int(self.deductions):
-                self.ded_detail = ded_dic_3
-                return
-
-            sys.exit("Some deductions are still missing")
-
-    def get_protocol_dic(self, segment):
-        dic = {"id": self.id, "segment_id": segment.id, "competitor_id": self.skater.id, "tes": self.tes_total,
-               "pcs": self.pcs_total, "tss": self.tss_total, "ded": self.deductions,
-               "starting_number": self.starting_number, "number_of_judges": self.number_of_judges}
-        return dic
-
-    def get_deductions_dic(self):
-        self.ded_detail["protocol_id"] = self.id
-        return self.ded_detail
+            # Read all three candidate row spans in one pass, and keep the first whose total matches
+            rows = [datarow.DataRow(df=df, row=r, col_min=j).raw for r in range(i, min(i + 3, df.shape[0]))]
+            candidates = deduction_parser.parse_candidates(rows)
+            for ded_dic in (candidates if is_old_ded_format else candidates[:1]):
+                if ded_dic is not None and sum(ded_dic.values()) * 100 == self.deductions:
+                    self.ded_detail = ded_dic
+                    return
+            # None candidates hold a deduction type deduction_parser doesn't know (see datarow.EXPECTED_DED_TYPES)
+            raise ValueError(f"Some deductions are still missing or unknown in protocol for "
+                             f"{dict(vars(self.skater))}: found {candidates}, expected a total of "
+                             f"{self.deductions / 100:.2f}")
+
+    def write_rows(self, segment):
+        self.tables["protocols"].append(id=self.id, segment_id=segment.id, competitor_id=self.skater.id,
+                                        tes=self.tes_total, pcs=self.pcs_total, tss=self.tss_total,
+                                        ded=self.deductions, starting_number=self.starting_number,
+                                        number_of_judges=self.number_of_judges)
+        self.tables["deductions_detail"].append_row(["protocol_id"] + list(self.ded_detail),
+                                                    [self.id] + list(self.ded_detail.values()))
 
 
 CONSTRUCTOR_DIC = {"IceDance": {"competitor": person.Team, "elt": element.IceDanceElement},
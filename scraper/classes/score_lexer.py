@@ -0,0 +1,44 @@
+import re
+import logging
+from collections import namedtuple
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message)s",
+                    level=logging.DEBUG,
+                    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+NUMBER, DASH, BONUS, NS, TEXT = "number", "dash", "bonus", "NS", "text"
+SCORE_KINDS = (NUMBER, DASH)
+
+Token = namedtuple("Token", ["kind", "text"])
+
+# One alternative per token kind, tried in order against each whitespace-delimited word. A score with the bonus flag
+# merged onto it ("6.60x") is the only word that yields two tokens.
+TOKEN_PATTERN = re.compile(r"\s*(?:(?P<merged>[\d.,]+)x"
+                           r"|(?P<dash>-)"
+                           r"|(?P<number>[-\d.,]+)"
+                           r"|(?P<NS>NS)"
+                           r"|(?P<bonus>[xX])"
+                           r"|(?P<text>\S+))(?=\s|$)")
+
+
+def lex(cells):
+    """ Splits a row's cells into typed tokens in a single pass over each cell's text.
+
+    Number tokens have comma decimals normalised to points, so '8,25' and '8.25' lex identically.
+
+    :param cells: List of non-empty cell values, as held in DataRow.raw
+    :return: List of Token(kind, text) tuples
+    """
+    tokens = []
+    for cell in cells:
+        for m in TOKEN_PATTERN.finditer(str(cell)):
+            kind = m.lastgroup
+            if kind == "merged":
+                tokens.append(Token(NUMBER, m.group(kind).replace(",", ".")))
+                tokens.append(Token(BONUS, "x"))
+            elif kind == NUMBER:
+                tokens.append(Token(NUMBER, m.group(kind).replace(",", ".")))
+            else:
+                tokens.append(Token(kind, m.group(kind)))
+    return tokens
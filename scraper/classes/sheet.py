@@ -0,0 +1,83 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message)s",
+                    level=logging.DEBUG,
+                    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+CELL_ANCHORS = ["Name", "Skating Skills", "Elements", "Deductions"]
+ROW_ANCHORS = ["Program Components"]
+
+
+class SheetGrid:
+    """ A sheet's cells as a NumPy object array, converted once, with a precomputed mask of non-empty cells.
+
+    Row extraction is a slice plus a boolean mask over the array rather than per-cell iloc lookups. Cell values are
+    the same objects the dataframe holds, so anything parsing them sees no difference.
+    """
+    def __init__(self, df):
+        self.values = np.asarray(df.values, dtype=object)
+        self.shape = self.values.shape
+        self.mask = ~pd.isnull(self.values)
+
+    def cell(self, row, col):
+        return self.values[row, col]
+
+    def row_values(self, row, col_min=0):
+        """ Returns the non-empty cells of a row from col_min onwards, left to right. """
+        return self.values[row, col_min:][self.mask[row, col_min:]].tolist()
+
+
+class AnchorIndex:
+    """ Locations of the headings protocol parsing keys off, built in a single pass over a sheet.
+
+    Cell anchors are matched against each cell's text, row anchors against the space-joined text of a row's non-empty
+    cells (which is how the end of the elements table has always been detected). Hits are stored in row-major order.
+    """
+    def __init__(self, grid, cell_anchors=CELL_ANCHORS, row_anchors=ROW_ANCHORS):
+        self.shape = grid.shape
+        self.cell_hits = {a: [] for a in cell_anchors}
+        self.row_hits = {a: [] for a in row_anchors}
+
+        for i, row in enumerate(grid.values):
+            row_text = []
+            for j, cell in enumerate(row):
+                text = str(cell)
+                for anchor in cell_anchors:
+                    if anchor in text:
+                        self.cell_hits[anchor].append((i, j))
+                if cell is not None and cell == cell:
+                    row_text.append(text)
+            joined = " ".join(row_text)
+            for anchor in row_anchors:
+                if anchor in joined:
+                    self.row_hits[anchor].append(i)
+
+    def find(self, anchor, rows=None, cols=None):
+        """ Returns the (row, col) hits for a cell anchor in row-major order, optionally restricted to row/col ranges.
+        """
+        return [(i, j) for (i, j) in self.cell_hits[anchor]
+                if (rows is None or i in rows) and (cols is None or j in cols)]
+
+    def find_in_order(self, anchors, rows=None, cols=None):
+        """ Merges the hits of several cell anchors into one row-major sweep of (row, col, anchor) tuples.
+
+        When a cell matches more than one anchor, only the first in the anchors list is reported, mirroring an
+        if/elif chain over the cell.
+        """
+        seen = {}
+        for anchor in anchors:
+            for coords in self.find(anchor, rows, cols):
+                if coords not in seen:
+                    seen[coords] = anchor
+        return [(i, j, seen[(i, j)]) for (i, j) in sorted(seen)]
+
+    def next_row(self, anchor, start_row):
+        """ Returns the first row at or after start_row whose joined text contains a row anchor, or None. """
+        for i in self.row_hits[anchor]:
+            if i >= start_row:
+                return i
+        return None
@@ -0,0 +1,159 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message)s",
+                    level=logging.DEBUG,
+                    datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+OUTPUT_TABLES = ["segments", "competitors", "protocols", "pcs_averages", "pcs_detail", "deductions_detail",
+                 "elements", "goe_detail"]
+
+# Columns that are always populated get a fixed dtype, so frames don't have to infer one from Python objects
+COLUMN_DTYPES = {"segments": {"id": "int64"},
+                 "competitors": {"id": "int64"},
+                 "protocols": {"id": "int64", "segment_id": "int64", "competitor_id": "int64",
+                               "number_of_judges": "int64"},
+                 "pcs_averages": {"id": "int64", "protocol_id": "int64"},
+                 "pcs_detail": {"pcs_avg_id": "int64"},
+                 "deductions_detail": {"protocol_id": "int64"},
+                 "elements": {"id": "int64", "protocol_id": "int64", "element_no": "int64"},
+                 "goe_detail": {"element_id": "int64"}}
+
+# Scores are parsed into integer hundredths of a point (see datarow.to_hundredths) and only turned back into points
+# here, as float64 columns, when a frame is built
+HUNDREDTHS_COLUMNS = {"protocols": ["tss", "tes", "pcs", "ded"],
+                      "pcs_averages": ["component_factor", "trimmed_av_cs"],
+                      "elements": ["bv", "sov_goe", "total"],
+                      "pcs_detail": ["pcs_score"]}
+
+# Wide judge/deduction tables are written out in long format: (key column, variable name, value name)
+LONG_FORMAT_TABLES = {"pcs_detail": ("pcs_avg_id", "judge_no", "pcs_score"),
+                      "goe_detail": ("element_id", "judge_no", "goe_score"),
+                      "deductions_detail": ("protocol_id", "deduction_type", "deductions_score")}
+
+# Rough memory per buffered cell: an 8-byte list slot plus a boxed int, float or short string
+CELL_BYTES = 40
+
+
+def _is_null(x):
+    return x is None or x != x
+
+
+class TableBuilder:
+    """ Append-only, column-oriented buffer for one output table.
+
+    Parsers append rows straight into per-column lists, so no per-row dict has to be kept until flush time. Columns
+    may appear part way through a batch (e.g. a new season's federation column or a tenth judge): earlier rows are
+    back-filled with None, as pd.DataFrame(list_of_dicts) would.
+    """
+    def __init__(self, name, dtypes=None, hundredths=None):
+        self.name = name
+        self.dtypes = dtypes or {}
+        self.hundredths = set(hundredths or [])
+        self.columns = {}
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def output_row_count(self):
+        """ Returns the number of rows this table will write, i.e. one per non-key cell for long-format tables. """
+        if self.name in LONG_FORMAT_TABLES:
+            return self.length * max(len(self.columns) - 1, 0)
+        return self.length
+
+    def estimated_bytes(self):
+        """ Returns a rough size of the buffered cells in memory: a list slot plus a boxed value per cell. """
+        return self.length * len(self.columns) * CELL_BYTES
+
+    def append_row(self, keys, values):
+        for key, value in zip(keys, values):
+            col = self.columns.get(key)
+            if col is None:
+                col = self.columns[key] = [None] * self.length
+            col.append(value)
+        self.length += 1
+        for col in self.columns.values():
+            if len(col) < self.length:
+                col.append(None)
+
+    def append(self, **fields):
+        self.append_row(fields.keys(), fields.values())
+
+    def mark(self):
+        """ Returns a savepoint that rollback can return the table to. """
+        return self.length, len(self.columns)
+
+    def rollback(self, mark):
+        """ Drops every row (and any column first seen) since mark was taken. """
+        (length, column_count) = mark
+        for key in list(self.columns)[column_count:]:
+            del self.columns[key]
+        for col in self.columns.values():
+            del col[length:]
+        self.length = length
+
+    def _column_array(self, key):
+        if key in self.hundredths:
+            return np.array(self.columns[key], dtype="float64") / 100
+        dtype = self.dtypes.get(key)
+        if dtype is not None:
+            return np.array(self.columns[key], dtype=dtype)
+        return self.columns[key]
+
+    def to_frame(self):
+        return pd.DataFrame({key: self._column_array(key) for key in self.columns}, columns=list(self.columns))
+
+    def to_long_frame(self, key_column, var_name, value_name):
+        """ Returns the table melted on key_column, with null values dropped.
+
+        Equivalent to df.melt(id_vars=[key_column], var_name=var_name, value_name=value_name) followed by a notnull
+        filter on the value column, but built straight from the column lists.
+        """
+        keys, variables, values = [], [], []
+        key_col = self.columns.get(key_column, [])
+        for name, col in self.columns.items():
+            if name == key_column:
+                continue
+            for key, value in zip(key_col, col):
+                if not _is_null(value):
+                    keys.append(key)
+                    variables.append(name)
+                    values.append(value)
+
+        if value_name in self.hundredths:
+            values = np.array(values, dtype="float64") / 100
+
+        dtype = self.dtypes.get(key_column)
+        return pd.DataFrame({key_column: np.array(keys, dtype=dtype) if dtype else keys,
+                             var_name: variables,
+                             value_name: values},
+                            columns=[key_column, var_name, value_name])
+
+
+def row_counts(tables):
+    """ Returns a dict of table name to number of output rows for a dict of TableBuilders. """
+    return {name: builder.output_row_count() for name, builder in tables.items()}
+
+
+def estimated_bytes(tables):
+    """ Returns the estimated memory held by a dict of TableBuilders, in bytes. """
+    return sum(builder.estimated_bytes() for builder in tables.values())
+
+
+def mark_tables(tables):
+    """ Returns savepoints for a dict of TableBuilders, e.g. before parsing a protocol that may have to be dropped. """
+    return {name: builder.mark() for name, builder in tables.items()}
+
+
+def rollback_tables(tables, marks):
+    for name, builder in tables.items():
+        builder.rollback(marks[name])
+
+
+def new_table_set():
+    """ Returns a dict of empty TableBuilders, one per output table. """
+    return {name: TableBuilder(name, COLUMN_DTYPES.get(name), HUNDREDTHS_COLUMNS.get(name)) for name in OUTPUT_TABLES}
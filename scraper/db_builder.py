@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
+import io
 import sys
 import logging
 
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 import pandas as pd
 import glob
 from sqlalchemy import create_engine
@@ -15,6 +17,8 @@ logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message
 logger = logging.getLogger(__name__)
 
 MODE = "fail" #or "append"
+LOAD_METHOD = "copy"  # or "insert" to go through DataFrame.to_sql
+BATCH_TABLE = "transform_batches"
 try:
     import settings
 except ImportError as exc:
@@ -58,29 +62,165 @@ def get_last_row_key(table_name, cursor):
     return 0
 
 
-def create_staging_table(df, conn_dic, table_name, fetch_last_row=False):
+def copy_dataframe(df, table_name, conn_dic, create=False, dtype=None):
+    """ Bulk loads a dataframe into a table by streaming it as CSV through COPY FROM STDIN.
+
+    Does not commit. When create is True, the table is first created with the column types to_sql would have used.
+
+    :param df: Dataframe to load
+    :param table_name: Name of target table
+    :param conn_dic: Dict of db connection objects
+    :param create: Whether to create the table first
+    :param dtype: Dict of column name to SQLAlchemy type, overriding the inferred type when creating the table
+    """
+    cursor = conn_dic["cursor"]
+    if create:
+        cursor.execute(pd.io.sql.get_schema(df, table_name, con=conn_dic["engine"], dtype=dtype))
+    if df.empty:
+        return
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="")
+    buffer.seek(0)
+
+    columns = sql.SQL(", ").join(sql.Identifier(c) for c in df.columns)
+    query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv);").format(sql.Identifier(table_name), columns)
+    cursor.copy_expert(query.as_string(conn_dic["conn"]), buffer)
+
+
+def create_staging_table(df, conn_dic, table_name, fetch_last_row=False, method=LOAD_METHOD, dtype=None):
     if fetch_last_row:
         last_row_num = get_last_row_key(table_name, conn_dic["cursor"])
         df.insert(0, "id", range(last_row_num + 1, last_row_num + 1 + len(df)))
 
     staging_name = "staging_" + table_name
-    try:
-        df.to_sql(staging_name, conn_dic["engine"], chunksize=10000, index=False)
-    except ValueError:
-        sys.exit(f"Could not create staging table {staging_name}")
+    if method == "copy":
+        if check_table_exists(staging_name, conn_dic["cursor"]):
+            sys.exit(f"Could not create staging table {staging_name}")
+        copy_dataframe(df, staging_name, conn_dic, create=True, dtype=dtype)
+        conn_dic["conn"].commit()
+    else:
+        try:
+            df.to_sql(staging_name, conn_dic["engine"], chunksize=10000, index=False, dtype=dtype)
+        except ValueError:
+            sys.exit(f"Could not create staging table {staging_name}")
     logger.info(f"Created staging table {staging_name}")
 
 
-def write_to_final_table(df, table_name, conn_dic):
-    staging_name = "staging_" + table_name
-    # Dropping staging table
-    conn_dic["cursor"].execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(staging_name)))
-    logger.info(f"Dropped staging table {staging_name}")
+def get_table_columns(table_name, cursor):
+    cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name=%s ORDER BY ordinal_position;",
+                   (table_name,))
+    return [r[0] for r in cursor.fetchall()]
+
+
+def get_column_types(table_name, cursor):
+    """ Returns a dict of column name to full SQL type (e.g. numeric(8,2)), in column order. """
+    cursor.execute("SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+                   "WHERE attrelid = to_regclass(quote_ident(%s)) AND attnum > 0 AND NOT attisdropped "
+                   "ORDER BY attnum;", (table_name,))
+    return dict(cursor.fetchall())
+
+
+def add_missing_columns(table_name, from_table, cursor):
+    """ Adds to table_name any column of from_table it doesn't have yet (e.g. a new output column or a tenth judge),
+    with the same full type. Columns that are NULL throughout from_table are left out, as their inferred type means
+    nothing: they are added by the first batch that holds a value. """
+    existing = set(get_table_columns(table_name, cursor))
+    for (column, data_type) in get_column_types(from_table, cursor).items():
+        if column in existing:
+            continue
+        cursor.execute(sql.SQL("SELECT EXISTS(SELECT 1 FROM {} WHERE {} IS NOT NULL);")
+                       .format(sql.Identifier(from_table), sql.Identifier(column)))
+        if not cursor.fetchone()[0]:
+            logger.info(f"Column {column} of {from_table} is all NULL, not adding it to {table_name} yet")
+            continue
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN {} {};").format(sql.Identifier(table_name),
+                                                                       sql.Identifier(column), sql.SQL(data_type)))
+        logger.warning(f"Schema change: added column {column} ({data_type}) to {table_name}")
+
+
+def write_to_final_table(table_name, conn_dic, commit=True):
+    """ Promotes a staging table into its final table on the server, then drops it, in a single transaction.
 
-    # Appending to table
-    df.to_sql(table_name, conn_dic["engine"], if_exists="append", index=False)
+    :param table_name: Name of final table (the staging table is "staging_" + table_name)
+    :param conn_dic: Dict of db connection objects
+    :param commit: Set to False to leave the transaction open, e.g. to promote several tables atomically
+    """
+    cursor = conn_dic["cursor"]
+    staging, final = sql.Identifier("staging_" + table_name), sql.Identifier(table_name)
+
+    if not check_table_exists(table_name, cursor):
+        cursor.execute(sql.SQL("CREATE TABLE {} (LIKE {});").format(final, staging))
+    else:
+        add_missing_columns(table_name, "staging_" + table_name, cursor)
+
+    # Staging types are inferred per batch (an all-None column comes out as text), so convert to the final types.
+    # Staged columns the final table doesn't have were all NULL (see add_missing_columns) and are simply left out
+    final_types = get_column_types(table_name, cursor)
+    columns = [c for c in get_table_columns("staging_" + table_name, cursor) if c in final_types]
+    if columns:
+        column_list = sql.SQL(", ").join(sql.Identifier(c) for c in columns)
+        cast_list = sql.SQL(", ").join(sql.SQL("CAST({} AS {})").format(sql.Identifier(c), sql.SQL(final_types[c]))
+                                       for c in columns)
+        cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {};").format(final, column_list, cast_list,
+                                                                              staging))
+        logger.info(f"Wrote {cursor.rowcount} rows to {table_name}")
+
+    cursor.execute(sql.SQL("DROP TABLE {};").format(staging))
+    if commit:
+        conn_dic["conn"].commit()
+    logger.info(f"Dropped staging table staging_{table_name}")
+
+
+def apply_fed_updates(table_name, fed_updates, cursor):
+    """ Fills in federations observed for rows already in table_name, with one set-based UPDATE per season field.
+    Doesn't commit, so the updates land in the transaction of the batch they were observed in. A federation only
+    replaces an empty field, or an ISU one.
+
+    :param table_name: Name of final table (competitors or officials)
+    :param fed_updates: List of (id, field, federation) tuples
+    """
+    by_field = {}
+    for (row_id, field, fed) in fed_updates:
+        feds = by_field.setdefault(field, {})
+        if feds.get(int(row_id)) in [None, "ISU"]:
+            feds[int(row_id)] = fed
+
+    existing = set(get_table_columns(table_name, cursor)) if by_field else set()
+    for field, feds in by_field.items():
+        if field not in existing:
+            # First sighting of this season was of people already in the table, so no staging table brought it in
+            cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN {} TEXT;").format(sql.Identifier(table_name),
+                                                                                sql.Identifier(field)))
+            logger.info(f"Added column {field} (text) to {table_name}")
+        query = sql.SQL("UPDATE {0} t SET {1} = v.fed FROM (VALUES %s) AS v (id, fed) WHERE t.id = v.id "
+                        "AND (t.{1} IS NULL OR (t.{1} = 'ISU' AND v.fed != 'ISU'));")\
+            .format(sql.Identifier(table_name), sql.Identifier(field))
+        execute_values(cursor, query.as_string(cursor), list(feds.items()), page_size=1000)
+        logger.info(f"Updated {field} of {len(feds)} {table_name} rows")
+
+
+def drop_staging_tables(table_names, conn_dic):
+    for table_name in table_names:
+        conn_dic["cursor"].execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier("staging_" + table_name)))
     conn_dic["conn"].commit()
-    logger.info(f"Wrote to {table_name}")
+
+
+def record_batch_commit(batch_id, files, cursor):
+    """ Writes a batch's commit marker. Run inside the batch's load transaction, so the marker exists iff the data does.
+    """
+    cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} (batch_id TEXT PRIMARY KEY, files TEXT[], "
+                           "committed_at TIMESTAMP DEFAULT now());").format(sql.Identifier(BATCH_TABLE)))
+    cursor.execute(sql.SQL("INSERT INTO {} (batch_id, files) VALUES (%s, %s);").format(sql.Identifier(BATCH_TABLE)),
+                   (batch_id, list(files)))
+
+
+def is_batch_committed(batch_id, cursor):
+    if not check_table_exists(BATCH_TABLE, cursor):
+        return False
+    cursor.execute(sql.SQL("SELECT EXISTS(SELECT 1 FROM {} WHERE batch_id=%s);").format(sql.Identifier(BATCH_TABLE)),
+                   (batch_id,))
+    return cursor.fetchone()[0]
 
 
 def initiate_connections(credentials_dic):
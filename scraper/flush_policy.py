@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FlushPolicy:
+    """ Decides when the rows accumulated so far should be written to the database as one batch.
+
+    A flush is due as soon as any high-water mark is reached: number of workbooks in the batch, number of output rows
+    in any table with a row limit, or estimated size of the batch in memory. Any mark set to None is ignored, so a
+    policy with only max_files set behaves like the old every-N-files counter.
+
+    Memory is bounded through the batch's own estimated size rather than the process's resident memory: the allocator
+    rarely hands freed memory back to the OS, so RSS says little about how much the current batch holds.
+
+    :param max_files: Maximum number of workbooks per batch
+    :param row_limits: Dict of table name to maximum number of output rows per batch
+    :param max_batch_mb: Maximum estimated size of the batch held in memory, in MB
+    """
+    def __init__(self, max_files=None, row_limits=None, max_batch_mb=None):
+        self.max_files = max_files
+        self.row_limits = row_limits or {}
+        self.max_batch_mb = max_batch_mb
+
+    def flush_reason(self, file_count, row_counts, batch_bytes=0):
+        """ Returns a short description of the high-water mark that was reached, or None if no flush is due.
+
+        :param file_count: Number of workbooks in the current batch
+        :param row_counts: Dict of table name to number of output rows in the current batch
+        :param batch_bytes: Estimated size of the current batch in memory, in bytes
+        """
+        if self.max_files is not None and file_count >= self.max_files:
+            return f"{file_count} files"
+
+        for table, limit in self.row_limits.items():
+            if row_counts.get(table, 0) >= limit:
+                return f"{row_counts[table]} {table} rows"
+
+        batch_mb = batch_bytes / (1024 * 1024)
+        if self.max_batch_mb is not None and batch_mb >= self.max_batch_mb:
+            return f"{batch_mb:.0f}MB estimated batch size"
+        return None
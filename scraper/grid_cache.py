@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+import os
+import sys
+import pickle
+import hashlib
+import logging
+import tempfile
+
+try:
+    import xlsx_reader
+except ImportError as exc:
+    sys.exit(f"Error: failed to import module ({exc})")
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever xlsx_reader changes what it returns, so stale grids are never reused
+CACHE_VERSION = 2
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, digest[:2], f"{digest}.v{CACHE_VERSION}.grid")
+
+
+def _read_entry(f):
+    """ Yields the (sheet name, grid) tuples of an open cache entry, which ends with a None marker once complete. """
+    while True:
+        sheet = pickle.load(f)
+        if sheet is None:
+            return
+        yield sheet
+
+
+class _EntryWriter:
+    """ Streams sheets into a temporary file, moved into place only once the whole workbook has been written, so
+    concurrent workers never see partial entries. Write errors just disable caching for the workbook. """
+    def __init__(self, path):
+        self.path, self.f, self.tmp_path = path, None, None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            self.f = os.fdopen(fd, "wb")
+        except OSError as exc:
+            self._fail(exc)
+
+    def _fail(self, exc):
+        logger.warning(f"Could not write grid cache entry {self.path} ({exc})")
+        self.discard()
+
+    def add(self, sheet):
+        if self.f is None:
+            return
+        try:
+            pickle.dump(sheet, self.f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as exc:
+            self._fail(exc)
+
+    def commit(self):
+        if self.f is None:
+            return
+        try:
+            pickle.dump(None, self.f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.f.close()
+            os.replace(self.tmp_path, self.path)
+            self.f = None
+        except OSError as exc:
+            self._fail(exc)
+
+    def discard(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if self.tmp_path is not None and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def iter_sheets(path, cache_dir=None):
+    """ Drop-in for xlsx_reader.iter_sheets that keeps a copy of each workbook's cell grids on disk.
+
+    Entries are keyed on a hash of the file's content (not its name or mtime), so re-runs over the same protocols
+    skip workbook decoding entirely, while any edited or re-converted file is decoded afresh. Each entry is a stream of
+    binary pickles, one per sheet, so sheets are yielded one at a time both when decoding and when reading from cache.
+
+    :param path: Path to .xlsx file
+    :param cache_dir: Directory holding cache entries, or None to disable caching
+    :return: Generator of (sheet name, grid) tuples
+    """
+    if cache_dir is None:
+        yield from xlsx_reader.iter_sheets(path)
+        return
+
+    entry_path = _cache_path(cache_dir, file_digest(path))
+    served = set()
+    if os.path.exists(entry_path):
+        try:
+            with open(entry_path, "rb") as f:
+                for name, grid in _read_entry(f):
+                    served.add(name)
+                    yield name, grid
+            logger.debug(f"Read grids for {path} from cache")
+            return
+        except (OSError, EOFError, pickle.UnpicklingError) as exc:
+            logger.warning(f"Ignoring unreadable grid cache entry {entry_path} ({exc})")
+
+    writer = _EntryWriter(entry_path)
+    try:
+        for name, grid in xlsx_reader.iter_sheets(path):
+            # Sheets already served from a cache entry that turned out to be truncated aren't yielded twice
+            if name not in served:
+                yield name, grid
+            writer.add((name, grid))
+        writer.commit()
+    finally:
+        writer.discard()
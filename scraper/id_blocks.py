@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+import sys
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Workers number new rows from this base, so that provisional keys can never collide with ids already in the database
+PROVISIONAL_ID_BASE = 10 ** 12
+
+ID_TABLES = ["deductions_detail", "pcs_averages", "pcs_detail", "goe_detail", "elements", "segments", "competitors",
+             "officials", "panels", "protocols"]
+
+# For each output table, the columns holding keys and the table those keys belong to
+KEY_COLUMNS = {"segments": {"id": "segments"},
+               "protocols": {"id": "protocols", "segment_id": "segments", "competitor_id": "competitors"},
+               "pcs_averages": {"id": "pcs_averages", "protocol_id": "protocols"},
+               "pcs_detail": {"id": "pcs_detail", "pcs_avg_id": "pcs_averages"},
+               "deductions_detail": {"id": "deductions_detail", "protocol_id": "protocols"},
+               "elements": {"id": "elements", "protocol_id": "protocols"},
+               "goe_detail": {"id": "goe_detail", "element_id": "elements"},
+               "competitors": {"id": "competitors", "lady_id": "competitors", "man_id": "competitors"}}
+
+
+def provisional_id_dic():
+    return {table: PROVISIONAL_ID_BASE for table in ID_TABLES}
+
+
+def _competitor_key(row):
+    if row["competitor_type"] == "team":
+        return "team", row["competitor_name"]
+    return "person", row["tight_full_name"]
+
+
+def _fed_columns(row):
+    return [k for k in row if k.endswith("_fed")]
+
+
+class IdBlockMerger:
+    """ Merges per-workbook results produced with provisional keys into one deterministic id sequence.
+
+    Each workbook is given a contiguous block of ids per table, reserved in the order workbooks are added (i.e. file
+    order, not completion order), so a parallel run numbers rows the same way however workers are scheduled. Ids
+    differ from a sequential run's though: convert_to_dfs leaves a gap after the long-format tables' ids, which
+    happens per workbook here but per batch in a sequential run. Competitors first seen in different workbooks are
+    de-duplicated on name across the whole run, like the shared skater list does in a sequential run.
+    """
+    def __init__(self, next_ids):
+        self.next_ids = dict(next_ids)
+        self.competitor_ids = {}
+        self.pending_frames = {}
+        self.pending_competitors = {}
+        self.fed_updates = []
+
+    def add(self, dfs, used_ids, fed_updates=()):
+        """ Reserves id blocks for one workbook's tables and queues its remapped frames for the next batch.
+
+        :param dfs: Dict of table name to dataframe, as returned by convert_to_dfs with provisional keys
+        :param used_ids: Dict of table name to number of provisional ids the workbook consumed
+        :param fed_updates: (competitor id, field, federation) tuples the workbook found for competitors already in
+                            the db, to apply with the next batch
+        """
+        self.fed_updates.extend(fed_updates)
+        offsets = {}
+        for table in ID_TABLES:
+            if table != "competitors":
+                offsets[table] = self.next_ids[table] - PROVISIONAL_ID_BASE
+                self.next_ids[table] += used_ids[table]
+
+        competitor_map = self._merge_competitors(dfs.get("competitors"))
+
+        for table, df in dfs.items():
+            if table == "competitors":
+                continue
+            for col, key_table in KEY_COLUMNS.get(table, {}).items():
+                if col not in df.columns:
+                    continue
+                if key_table == "competitors":
+                    df[col] = df[col].map(lambda x: competitor_map.get(x, x))
+                else:
+                    df[col] = df[col].where(df[col] < PROVISIONAL_ID_BASE, df[col] + offsets[key_table])
+            self.pending_frames.setdefault(table, []).append(df)
+
+    def _merge_competitors(self, df):
+        competitor_map = {}
+        if df is None or df.empty:
+            return competitor_map
+
+        for row in df.to_dict(orient="records"):
+            provisional_id = row["id"]
+            for col in ["lady_id", "man_id"]:
+                if col in row and row[col] == row[col] and row[col] is not None:
+                    row[col] = competitor_map.get(row[col], row[col])
+
+            key = _competitor_key(row)
+            if key in self.competitor_ids:
+                competitor_map[provisional_id] = self.competitor_ids[key]
+                self._merge_feds(key, row)
+                continue
+
+            row["id"] = self.next_ids["competitors"]
+            self.next_ids["competitors"] += 1
+            self.competitor_ids[key] = row["id"]
+            competitor_map[provisional_id] = row["id"]
+            self.pending_competitors[key] = row
+        return competitor_map
+
+    def _merge_feds(self, key, row):
+        existing = self.pending_competitors.get(key)
+        for field in _fed_columns(row):
+            value = row[field]
+            if value is None or value != value:
+                continue
+            if existing is None:
+                # Already written in an earlier batch, so patch it in the database instead
+                self.fed_updates.append((self.competitor_ids[key], field, value))
+            elif field not in existing or existing[field] is None or existing[field] != existing[field] or \
+                    (existing[field] == "ISU" and value != "ISU"):
+                existing[field] = value
+
+    def has_pending(self):
+        return bool(self.pending_frames) or bool(self.pending_competitors)
+
+    def pending_row_counts(self):
+        counts = {table: sum(len(df) for df in frames) for table, frames in self.pending_frames.items()}
+        counts["competitors"] = len(self.pending_competitors)
+        return counts
+
+    def pending_bytes(self):
+        """ Returns the memory held by the queued frames and competitor rows, in bytes (shallow for object columns). """
+        frame_bytes = sum(int(df.memory_usage(index=False).sum()) for frames in self.pending_frames.values()
+                          for df in frames)
+        return frame_bytes + sum(sys.getsizeof(row) for row in self.pending_competitors.values())
+
+    def pop_batch(self):
+        """ Returns the merged dataframes and outstanding federation updates queued since the last call.
+
+        :return: Tuple of (dict of table name to dataframe, list of (competitor id, field, federation) tuples)
+        """
+        dfs = {table: pd.concat(frames, ignore_index=True) for table, frames in self.pending_frames.items()}
+        dfs["competitors"] = pd.DataFrame(list(self.pending_competitors.values()))
+        fed_updates = self.fed_updates
+
+        self.pending_frames, self.pending_competitors, self.fed_updates = {}, {}, []
+        return dfs, fed_updates
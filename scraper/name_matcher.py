@@ -5,6 +5,7 @@ import numpy as np
 import pandas as pd
 import psycopg2
 import recordlinkage
+from recordlinkage.preprocessing import clean, phonetic
 
 from psycopg2 import sql
 from sqlalchemy import create_engine
@@ -21,6 +22,12 @@ bad_matches = [
     ['anastasia tarakanova', 'anastasiia gubanova']
 ]
 
+# Candidate pairs are names within this many places of each other when sorted on last name, plus names sharing the
+# phonetic code of their first or last word, plus names sharing the sorted pair of both codes (which catches
+# family-name-first spellings, e.g. yuna kim and kim yuna), within a discipline
+SORTED_NEIGHBOURHOOD_WINDOW = 9
+PHONETIC_METHOD = 'nysiis'
+
 conn = psycopg2.connect(database=settings.DB, user=settings.UN, password=settings.PW, host=settings.H,
                         port=settings.PORT)
 
@@ -46,10 +53,32 @@ def bad_match(row):
     return False
 
 
+def blocking_keys(df):
+    words = clean(df['name']).str.split()
+    keys = pd.DataFrame({'last_name': words.str[-1].fillna(''), 'first_name': words.str[0].fillna('')},
+                        index=df.index)
+    keys['last_name_phonetic'] = phonetic(keys['last_name'], method=PHONETIC_METHOD)
+    keys['first_name_phonetic'] = phonetic(keys['first_name'], method=PHONETIC_METHOD)
+    # Same key whichever order the first and last words come in
+    keys['name_words_phonetic'] = ['|'.join(sorted(codes)) for codes in
+                                   zip(keys['first_name_phonetic'].fillna(''), keys['last_name_phonetic'].fillna(''))]
+    if 'disc' in df.columns:
+        keys['disc'] = df['disc']
+    return keys
+
+
 def linkage(df):
+    # Officials have no discipline, so they are only blocked on their names
+    block_on = ['disc'] if 'disc' in df.columns else []
+    keys = blocking_keys(df)
+
     indexer = recordlinkage.Index()
-    indexer.full()
-    pairs = indexer.index(df)
+    indexer.sortedneighbourhood('last_name', window=SORTED_NEIGHBOURHOOD_WINDOW, block_on=block_on)
+    indexer.block(block_on + ['last_name_phonetic'])
+    indexer.block(block_on + ['first_name_phonetic'])
+    indexer.block(block_on + ['name_words_phonetic'])
+    pairs = indexer.index(keys)
+    logger.info(f'Comparing {len(pairs)} candidate pairs out of {len(df) * (len(df) - 1) // 2}')
     compare_cl = recordlinkage.Compare()
     compare_cl.string('name', 'name', method='cosine', label='name_match')
 
@@ -61,7 +90,8 @@ def linkage(df):
 
     matched = matches.merge(df, left_on='line_id_1', right_on='line_id')
     matched = matched.merge(df, left_on='line_id_2', right_on='line_id', suffixes=['_First', '_Second'])
-    matched = matched[(matched['disc_First'] == matched['disc_Second'])]
+    if block_on:
+        matched = matched[(matched['disc_First'] == matched['disc_Second'])]
 
     matched['bad_match'] = matched.apply(bad_match, axis=1)
 
@@ -108,9 +108,15 @@ def convert_and_upload(search_obj, list_of_officials, list_of_panels, conn_dic,
     if ENABLE_PAUSE:
         input("Hit Enter to write to main tables")
     if officials_df is not None and not officials_df.empty:
-        db_builder.write_to_final_table(df=officials_df, conn_dic=conn_dic, table_name="officials")
+        db_builder.write_to_final_table(conn_dic=conn_dic, table_name="officials", commit=False)
     if ided is not None and not ided.empty:
-        db_builder.write_to_final_table(df=ided, conn_dic=conn_dic, table_name="panels")
+        db_builder.write_to_final_table(conn_dic=conn_dic, table_name="panels", commit=False)
+
+    # Officials seen again under a federation their row didn't have yet, committed together with the new rows
+    index = person.get_identity_index(conn_dic, "officials")
+    db_builder.apply_fed_updates("officials", index.pop_fed_updates(), conn_dic["cursor"])
+    conn_dic["conn"].commit()
+    index.commit_pending()
 
     return [], []
 
@@ -118,6 +124,7 @@ def convert_and_upload(search_obj, list_of_officials, list_of_panels, conn_dic,
 def main(mode):
     conn, engine = db_builder.initiate_connections(settings.DB_CREDENTIALS)
     conn_dic = {"conn": conn, "engine": engine, "cursor": conn.cursor()}
+    person.get_identity_index(conn_dic, "officials")
 
     rows = {}
     for x in ["officials", "panels"]:
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+import os
+import json
+import logging
+import traceback
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+QUARANTINE_FILENAME = "quarantine.jsonl"
+
+QUARANTINED, RESOLVED = "quarantined", "resolved"
+
+
+def item_id(file_name, sheet_name, coords):
+    """ Identifies a protocol by workbook, sheet and row span, so re-parsing the same file can't duplicate entries. """
+    return f"{file_name}|{sheet_name}|{coords[0]}-{coords[1]}"
+
+
+def make_record(file_name, sheet_name, coords, raw_rows, error, trace=()):
+    """ Builds the quarantine entry for a protocol that failed to parse.
+
+    :param file_name: Name of the .xlsx file
+    :param sheet_name: Name of the sheet the protocol is on
+    :param coords: (first row, last row) of the protocol on the sheet
+    :param raw_rows: Non-empty cells of each of the protocol's rows
+    :param error: The exception raised while parsing
+    :param trace: Diagnostics messages captured while parsing (see diagnostics.Trace)
+    :return: Dict
+    """
+    return {"id": item_id(file_name, sheet_name, coords), "state": QUARANTINED, "file": file_name,
+            "sheet": sheet_name, "rows": list(coords), "raw_rows": raw_rows,
+            "error": f"{type(error).__name__}: {error}",
+            "traceback": "".join(traceback.format_exception(type(error), error, error.__traceback__)),
+            "trace": list(trace)}
+
+
+class Quarantine:
+    """ Append-only record of the protocols a fail-soft run skipped, and of those since retried successfully.
+
+    Kept next to the input files like the batch journal. The latest record for an id wins, so a protocol that fails
+    again on retry is simply quarantined again with its new error.
+    """
+    def __init__(self, read_path):
+        self.path = os.path.join(read_path, QUARANTINE_FILENAME)
+        self.items = {}
+        self.torn_tail = False
+        if os.path.exists(self.path):
+            self._replay()
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                self.torn_tail = not line.endswith("\n")
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Ignoring unreadable quarantine line in {self.path}: {line!r}")
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        if record["state"] == QUARANTINED:
+            self.items[record["id"]] = record
+        else:
+            self.items.pop(record["id"], None)
+
+    def _write(self, record):
+        record["time"] = datetime.now().isoformat()
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self.torn_tail:
+                f.write("\n")
+                self.torn_tail = False
+            f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(record)
+
+    def add(self, record):
+        self._write(record)
+        logger.error(f"Quarantined {record['id']}: {record['error']}")
+
+    def resolve(self, ids):
+        for i in ids:
+            self._write({"id": i, "state": RESOLVED})
+
+    def pending(self):
+        """ Returns the quarantined records not yet resolved, grouped as {file name: {sheet name: [records]}}. """
+        grouped = {}
+        for record in self.items.values():
+            grouped.setdefault(record["file"], {}).setdefault(record["sheet"], []).append(record)
+        return grouped
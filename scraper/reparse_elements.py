@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+"""
+Re-derives the label-based columns of the elements table (name, type, level, calls, flags, jumps) from the stored
+element_label, after a change to the element patterns in element.py, without re-running the PDF -> xlsx -> transform
+pipeline. Only rows whose derived columns change are written back.
+
+Usage: python reparse_elements.py [--dry-run]
+"""
+
+import pandas as pd
+from psycopg2 import sql
+
+import os
+import sys
+import logging
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)-5s - %(message)s",
+                    level=logging.INFO,
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+p_list = [os.path.abspath("./classes/"), os.path.abspath("..")]
+for path in p_list:
+    if path not in sys.path:
+        sys.path.append(path)
+
+try:
+    import settings
+    import event
+    import element
+    import db_builder
+    import diagnostics
+except ImportError as exc:
+    sys.exit(f"Error: failed to import module ({exc})")
+
+META_DISCIPLINES = {"Ladies": "Singles", "Men": "Singles", "Pairs": "Pairs", "IceDance": "IceDance"}
+KEY_COLUMNS = ["element_label", "meta_disc", "season"]
+STAGING_TABLE = "staging_elements_reparse"
+
+
+def read_elements(conn_dic, derived_columns):
+    """ Reads every labelled element with its parsing context and current values of the derived columns. """
+    query = sql.SQL("SELECT e.id, e.element_label, s.discipline, s.name AS segment_name, s.year, {} "
+                    "FROM elements e JOIN protocols p ON e.protocol_id = p.id JOIN segments s ON p.segment_id = s.id "
+                    "WHERE e.element_label IS NOT NULL;")\
+        .format(sql.SQL(", ").join(sql.SQL("e.") + sql.Identifier(c) for c in derived_columns))
+    df = pd.read_sql(query.as_string(conn_dic["conn"]), conn_dic["engine"])
+
+    df["meta_disc"] = df["discipline"].map(META_DISCIPLINES)
+    seasons = {(n, y): event.Event(n, int(y)).season
+               for (n, y) in df[["segment_name", "year"]].drop_duplicates().itertuples(index=False)}
+    df["season"] = [seasons[k] for k in zip(df["segment_name"], df["year"])]
+    return df
+
+
+def derive_columns(keys, derived_columns):
+    """ Parses each distinct (label, meta-discipline, season) once.
+
+    :param keys: Dataframe of distinct KEY_COLUMNS
+    :param derived_columns: Columns of the elements table to re-derive
+    :return: Dataframe of KEY_COLUMNS plus derived_columns, without the labels that no longer parse
+    """
+    records, new_columns = [], set()
+    for (label, meta_disc, season) in keys.itertuples(index=False):
+        try:
+            derived = element.derive_label_columns(label, meta_disc, season)
+        except ValueError as exc:
+            logger.error(f"Could not reparse {label} ({meta_disc}, {season}), leaving its rows as they are: {exc}")
+            continue
+        new_columns.update(derived.keys() - set(derived_columns))
+        records.append(dict(derived, element_label=label, meta_disc=meta_disc, season=season))
+
+    if new_columns:
+        logger.warning(f"Reparsed labels yield columns the elements table doesn't have, not written: {new_columns}")
+    return pd.DataFrame.from_records(records, columns=KEY_COLUMNS + derived_columns)
+
+
+def changed_rows(current, derived, derived_columns):
+    """ Returns the id and derived columns of the elements whose derived values differ from their stored ones. """
+    merged = current[["id"] + KEY_COLUMNS + derived_columns].merge(derived, on=KEY_COLUMNS, suffixes=("", "_new"))
+    changed = pd.Series(False, index=merged.index)
+    for c in derived_columns:
+        old, new = merged[c].astype(object), merged[c + "_new"].astype(object)
+        changed |= ~((old == new) | (old.isna() & new.isna()))
+
+    updates = merged.loc[changed, ["id"] + [c + "_new" for c in derived_columns]]
+    return updates.rename(columns={c + "_new": c for c in derived_columns})
+
+
+def integral_floats_as_ints(df):
+    """ Returns df with float columns that only hold whole numbers (e.g. flags stored next to NULLs) as Python ints,
+    so that COPY writes 1 rather than 1.0, which an integer column rejects. """
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype.kind == "f" and (df[c].dropna() % 1 == 0).all():
+            df[c] = pd.Series([int(v) if v == v else None for v in df[c]], index=df.index, dtype=object)
+    return df
+
+
+def write_updates(updates, conn_dic):
+    """ Copies the changed rows to a staging table and updates elements from it server-side, in one transaction.
+
+    The staging table takes its column types from elements, and is dropped when the transaction commits.
+    """
+    cursor = conn_dic["cursor"]
+    columns = sql.SQL(", ").join(sql.Identifier(c) for c in updates.columns)
+    cursor.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM elements WITH NO DATA;")
+                   .format(sql.Identifier(STAGING_TABLE), columns))
+    db_builder.copy_dataframe(integral_floats_as_ints(updates), STAGING_TABLE, conn_dic)
+
+    assignments = sql.SQL(", ").join(sql.SQL("{0} = s.{0}").format(sql.Identifier(c))
+                                     for c in updates.columns if c != "id")
+    cursor.execute(sql.SQL("UPDATE elements e SET {} FROM {} s WHERE e.id = s.id;")
+                   .format(assignments, sql.Identifier(STAGING_TABLE)))
+    logger.info(f"Updated {cursor.rowcount} rows of elements")
+    conn_dic["conn"].commit()
+
+
+def reparse_elements(db_credentials, dry_run=False):
+    """ Re-derives the elements table's label-based columns with the current element.py and writes back changes.
+
+    :param db_credentials: Dict of db credentials
+    :param dry_run: Only report how many rows would change
+    """
+    diagnostics.configure(mode=diagnostics.OFF)
+    conn, engine = db_builder.initiate_connections(db_credentials)
+    conn_dic = {"conn": conn, "engine": engine, "cursor": conn.cursor()}
+
+    if "element_label" not in db_builder.get_table_columns("elements", conn_dic["cursor"]):
+        sys.exit("The elements table has no element_label column: reload it with the transformer first")
+    derived_columns = [c for c in db_builder.get_table_columns("elements", conn_dic["cursor"])
+                       if c not in element.NON_LABEL_COLUMNS | {"protocol_id"}]
+
+    current = read_elements(conn_dic, derived_columns)
+    keys = current[KEY_COLUMNS].drop_duplicates()
+    logger.info(f"Read {len(current)} labelled elements, {len(keys)} distinct labels to reparse")
+
+    updates = changed_rows(current, derive_columns(keys, derived_columns), derived_columns)
+    logger.info(f"{len(updates)} elements have changed")
+    if not dry_run and not updates.empty:
+        write_updates(updates, conn_dic)
+    conn.close()
+
+
+if __name__ == "__main__":
+    reparse_elements(settings.DB_CREDENTIALS, dry_run="--dry-run" in sys.argv)
@@ -4,7 +4,10 @@
 import glob
 import pandas as pd
 from openpyxl import load_workbook
+from sqlalchemy.types import Numeric
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import os
 import sys
@@ -12,7 +15,7 @@ import logging
 
 logging.basicConfig(#filename="transformer" + datetime.today().strftime("%Y-%m-%d_%H-%M-%S") + ".log",
                     format="%(asctime)s - %(name)s - %(levelname)-5s - %(message)s",
-                    level=5,  # logging.DEBUG,
+                    level=logging.INFO,  # Lower to 15 or 5 (TRACE) along with DIAGNOSTICS_MODE = "verbose"
                     datefmt="%Y-%m-%d %H:%M:%S")
 
 logging.addLevelName(15, "MORE_INFO")
@@ -30,7 +33,15 @@ try:
     import event
     import person
     import protocol
+    import sheet
+    import table_builder
     import db_builder
+    import id_blocks
+    import grid_cache
+    import batch_journal
+    import flush_policy
+    import diagnostics
+    import quarantine
 except ImportError as exc:
     sys.exit(f"Error: failed to import module ({exc})")
 
@@ -38,6 +49,14 @@ except ImportError as exc:
 # ------------------------------------------ CHANGE RUN PARAMETERS HERE ------------------------------------------------
 ENABLE_WRITE_PAUSE = False
 ENABLE_DEBUGGING_PAUSE = False
+WORKER_PROCESSES = 1  # Set above 1 to parse workbooks in parallel worker processes
+WORKBOOKS_IN_FLIGHT_PER_WORKER = 2  # Parsed-but-unloaded workbooks held per worker, so loading can't fall far behind
+GRID_CACHE_DIR = None  # Set to a directory to cache decoded sheet grids between re-parse runs
+FLUSH_ROW_LIMITS = {"elements": 100000, "goe_detail": 1000000, "pcs_detail": 500000}  # Output rows per batch
+FLUSH_MAX_BATCH_MB = 1024  # Flush early once the batch is estimated to hold this much memory, None to disable
+DIAGNOSTICS_MODE = "capture"  # "capture" logs a protocol's trace only if it fails, "verbose" logs all, "off" none
+DIAGNOSTICS_SAMPLE_RATE = 0.0  # Fraction of successful protocols whose trace is logged anyway in capture mode
+FAIL_SOFT = True  # Quarantine protocols that fail to parse (see quarantine.py) and carry on, rather than stopping
 # ----------------------------------------------------------------------------------------------------------------------
 
 ABBREV_DIC = {'gpjpn': 'NHK', 'gpfra': 'TDF', 'gpcan': 'SC', 'gprus': 'COR', 'gpusa': 'SA', 'gpchn': 'COC',
@@ -51,93 +70,104 @@ def reorder_cols(df, col_to_move, new_pos):
     return df[cols]
 
 
-def find_protocol_coordinates(df):
-    protocol_starts, protocol_ends = [], []
-    for i in df.index:
-        for j in range(0, 6):
-            if "Name" in str(df.iloc[i, j]):
-                protocol_starts.append(i)
-            if "Deductions" in str(df.iloc[i, j]) and j < 4:
-                protocol_ends.append(i)
+def find_protocol_coordinates(anchors):
+    protocol_starts = [i for (i, j) in anchors.find("Name", cols=range(0, 6))]
+    protocol_ends = [i for (i, j) in anchors.find("Deductions", cols=range(0, 4))]
     return list(zip(protocol_starts, protocol_ends))
 
 
-def scrape_sheet(df, segment, last_row_dic, skater_list, conn_dic):
-    protocol_coords = find_protocol_coordinates(df)
+def scrape_sheet(df, segment, last_row_dic, skater_list, conn_dic, tables, source=None, quarantined=None,
+                 protocol_coords=None):
+    """ Parses the protocols on one sheet into tables.
+
+    :param df: Dataframe of the sheet's raw cells
+    :param segment: ScoredSegment the sheet belongs to
+    :param last_row_dic: Dict of next primary key per table, incremented as rows are created
+    :param skater_list: List of competitors first seen in the current batch
+    :param conn_dic: Dict of db connection objects
+    :param tables: Dict of TableBuilders the parsed rows are written into
+    :param source: (file name, sheet name), to identify quarantined protocols
+    :param quarantined: List to append a quarantine record to for each protocol that fails to parse, after rolling
+                        back whatever it had written. If None, the first failure is raised instead
+    :param protocol_coords: (first row, last row) of the protocols to parse, all those on the sheet if None
+    """
+    df = sheet.SheetGrid(df)
+    anchors = sheet.AnchorIndex(df)
+    if protocol_coords is None:
+        protocol_coords = find_protocol_coordinates(anchors)
     logger.debug(f"Protocol coordinates are {protocol_coords}")
+    judge_counts = {}
 
     for c in protocol_coords:
-        prot = protocol.Protocol(df=df,
-                                 protocol_coordinates=c,
-                                 segment=segment,
-                                 last_row_dic=last_row_dic,
-                                 skater_list=skater_list,
-                                 conn_dic=conn_dic)
-        for i in prot.row_range:
-            for j in prot.col_range:
-                if "Skating Skills" in str(df.iloc[i, j]):
-                    if ENABLE_DEBUGGING_PAUSE:
-                        input("Found pcs hit Enter to continue")
-                    try:
-                        prot.parse_pcs_table(df, i, j, last_row_dic)
-                    except ValueError as ve:
-                        sys.exit(f"Encountered error reading PCS row in {segment.name} {segment.year} "
-                                 f"{segment.discipline} {segment.segment}, {dict(vars(prot.skater))}: {ve}")
-                elif "Elements" in str(df.iloc[i, j]):
-                    try:
-                        if ENABLE_DEBUGGING_PAUSE:
-                            input("Found elements hit Enter to continue")
-                        prot.parse_tes_table(df, i, j, last_row_dic)
-                    except ValueError as ve:
-                        sys.exit(f"Encountered error reading TES row in {segment.name} {segment.year} "
-                                 f"{segment.discipline} {segment.segment}, {dict(vars(prot.skater))}: {ve}")
-                elif "Deductions" in str(df.iloc[i, j]) and j < 4:
-                    if ENABLE_DEBUGGING_PAUSE:
-                        input("Found deductions hit Enter to continue")
-                    prot.parse_deductions(df, i, j, segment)
-        segment.protocol_list.append(prot)
-
-
-def convert_to_dfs(segment_list, competitor_list, id_dic):
-    all_dics = {"segments": [], "competitors": [], "protocols": [], "pcs_averages": [], "pcs_detail": [],
-                "deductions_detail": [], "elements": [], "goe_detail": []}
-    all_dfs = {}
-
-    for s in segment_list:
-        if "segments" in all_dics:
-            all_dics["segments"].append(s.get_segment_dic())
-
-        for p in s.protocol_list:
-            all_dics["protocols"].append(p.get_protocol_dic(segment=s))
-            all_dics["pcs_averages"].extend(p.pcs_av_list)
-            all_dics["pcs_detail"].extend(p.pcs_detail_list)
-            all_dics["deductions_detail"].append(p.get_deductions_dic())
-
-            for e in p.elts:
-                elt_dic = e.get_element_dic()
-                elt_dic["protocol_id"] = p.id
-                all_dics["elements"].append(elt_dic)
-
-                if e.goe_dic:
-                    all_dics["goe_detail"].append(e.goe_dic)
-
+        description = f"protocol at rows {c[0]}-{c[1]} of {segment.name} {segment.year} {segment.discipline} " \
+                      f"{segment.segment}"
+        marks, next_ids, skater_count, trace = table_builder.mark_tables(tables), dict(last_row_dic), \
+            len(skater_list), None
+        index = person.get_identity_index(conn_dic, "competitors")
+        index_mark = index.mark()
+        try:
+            with diagnostics.protocol_trace(description) as trace:
+                scrape_protocol(df, anchors, c, segment, last_row_dic, skater_list, conn_dic, tables, judge_counts)
+        except Exception as exc:
+            if quarantined is None:
+                raise
+            table_builder.rollback_tables(tables, marks)
+            index.rollback(index_mark)
+            last_row_dic.update(next_ids)
+            del skater_list[skater_count:]
+            (file_name, sheet_name) = source
+            quarantined.append(quarantine.make_record(file_name, sheet_name, c,
+                                                      raw_rows=[df.row_values(r) for r in range(c[0], c[1] + 1)],
+                                                      error=exc, trace=trace.lines() if trace else ()))
+
+
+def scrape_protocol(df, anchors, c, segment, last_row_dic, skater_list, conn_dic, tables, judge_counts):
+    prot = protocol.Protocol(df=df,
+                             protocol_coordinates=c,
+                             segment=segment,
+                             last_row_dic=last_row_dic,
+                             skater_list=skater_list,
+                             conn_dic=conn_dic,
+                             tables=tables,
+                             anchors=anchors,
+                             judge_counts=judge_counts)
+    for (i, j, anchor) in anchors.find_in_order(["Skating Skills", "Elements", "Deductions"],
+                                                rows=prot.row_range, cols=prot.col_range):
+        if anchor == "Skating Skills":
+            if ENABLE_DEBUGGING_PAUSE:
+                input("Found pcs hit Enter to continue")
+            try:
+                prot.parse_pcs_table(df, i, j, last_row_dic)
+            except ValueError as ve:
+                raise ValueError(f"Encountered error reading PCS row in {segment.name} {segment.year} "
+                                 f"{segment.discipline} {segment.segment}, {dict(vars(prot.skater))}: {ve}") from ve
+        elif anchor == "Elements":
+            try:
+                if ENABLE_DEBUGGING_PAUSE:
+                    input("Found elements hit Enter to continue")
+                prot.parse_tes_table(df, i, j, last_row_dic)
+            except ValueError as ve:
+                raise ValueError(f"Encountered error reading TES row in {segment.name} {segment.year} "
+                                 f"{segment.discipline} {segment.segment}, {dict(vars(prot.skater))}: {ve}") from ve
+        elif anchor == "Deductions" and j < 4:
+            if ENABLE_DEBUGGING_PAUSE:
+                input("Found deductions hit Enter to continue")
+            prot.parse_deductions(df, i, j, segment)
+    prot.write_rows(segment)
+
+
+def convert_to_dfs(tables, competitor_list, id_dic):
     for c in competitor_list:
-        all_dics["competitors"].append(c.get_competitor_dict())
-
-    for key in all_dics:
-        all_dfs[key] = pd.DataFrame(all_dics[key])
+        tables["competitors"].append(**c.get_competitor_dict())
 
-    dic = {"pcs": ["pcs_avg", "judge_no"],
-           "goe": ["element", "judge_no"],
-           "deductions": ["protocol", "deduction_type"]}
-
-    for s in dic:
-        key = s + "_detail"
-        crossref_id = dic[s][0] + "_id"
-        all_dfs[key] = all_dfs[key].melt(id_vars=[crossref_id], var_name=dic[s][1], value_name=s + "_score")
-        all_dfs[key] = all_dfs[key][all_dfs[key][s + "_score"].notnull()]
-        all_dfs[key].insert(0, "id", range(id_dic[key], id_dic[key] + len(all_dfs[key])))
-        id_dic[key] += (len(all_dfs[key]) + 1)
+    all_dfs = {}
+    for key, builder in tables.items():
+        if key in table_builder.LONG_FORMAT_TABLES:
+            all_dfs[key] = builder.to_long_frame(*table_builder.LONG_FORMAT_TABLES[key])
+            all_dfs[key].insert(0, "id", range(id_dic[key], id_dic[key] + len(all_dfs[key])))
+            id_dic[key] += (len(all_dfs[key]) + 1)
+        else:
+            all_dfs[key] = builder.to_frame()
 
     return all_dfs
 
@@ -185,78 +215,329 @@ def clean_pyeongchang_protocols(read_path):
         os.rename(current_path, done_path)
 
 
-def transform_and_load(read_path, counter, db_credentials):
+def read_workbook(f, rows, skater_list, conn_dic, tables, quarantined=None):
+    """ Parses every sheet of one converted protocol workbook.
+
+    :param f: Path to .xlsx file
+    :param rows: Dict of next primary key per table, incremented as rows are created
+    :param skater_list: List of competitors first seen in the current batch
+    :param conn_dic: Dict of db connection objects
+    :param tables: Dict of TableBuilders the parsed rows are written into
+    :param quarantined: List collecting quarantine records of protocols that failed to parse (fail-soft mode), or
+                        None to stop at the first failure
+    :return: ScoredSegment object, or None if the file was skipped
+    """
+    filename = f.rpartition("/")[2]
+    basename = filename.rpartition(".")[0]
+    logger.info(f"Attempting to read {basename}")
+
+    try:
+        disc = event.parse_discipline(filename)
+    except ValueError:
+        logger.error(f"Passing on file {filename}")
+        return None
+
+    try:
+        seg = event.ScoredSegment(name_to_parse=basename, discipline=disc, id_dic=rows)
+    except ValueError as ve:
+        logger.error(f"Failed to instantiate ScoredSegment object: {ve}")
+        return None
+    tables["segments"].append(**seg.get_segment_dic())
+
+    for sheet_name, grid in grid_cache.iter_sheets(f, cache_dir=GRID_CACHE_DIR):
+        raw_df = pd.DataFrame(grid)
+        scrape_sheet(df=raw_df, segment=seg, last_row_dic=rows, skater_list=skater_list, conn_dic=conn_dic,
+                     tables=tables, source=(filename, sheet_name), quarantined=quarantined)
+    return seg
+
+
+def commit_batch(dfs, batch_files, journal, read_path, conn_dic, fed_updates=()):
+    """ Loads one batch and moves its files to done/, journaling each step so a crash at any point can be resumed.
+
+    Every table is promoted, and the batch's commit marker written, in one transaction: either the whole batch is in
+    the final tables or none of it is. Files only move to done/ once that transaction has committed.
+
+    :param dfs: Dict of table name to dataframe
+    :param batch_files: List of paths of the files that produced dfs
+    :param journal: BatchJournal for this read_path
+    :param read_path: Directory files are read from
+    :param conn_dic: Dict of db connection objects
+    :param fed_updates: List of (competitor id, field, federation) tuples to apply with the batch
+    """
+    batch_id = journal.begin(batch_files)
+
+    for k in dfs:
+        # Scores leave the parser as exact hundredths, so store them as fixed-point rather than floating point
+        score_dtypes = {c: Numeric(8, 2) for c in table_builder.HUNDREDTHS_COLUMNS.get(k, [])}
+        db_builder.create_staging_table(df=dfs[k], conn_dic=conn_dic, table_name=k, fetch_last_row=False,
+                                        dtype=score_dtypes)
+
+    if ENABLE_WRITE_PAUSE:
+        input("Hit Enter to write to main tables")
+
+    for k in dfs:
+        db_builder.write_to_final_table(table_name=k, conn_dic=conn_dic, commit=False)
+    db_builder.apply_fed_updates("competitors", fed_updates, conn_dic["cursor"])
+    db_builder.record_batch_commit(batch_id, batch_files, conn_dic["cursor"])
+    conn_dic["conn"].commit()
+    journal.mark_committed(batch_id)
+
+    for f in batch_files:
+        move_to_done(read_path, f)
+    journal.mark_done(batch_id)
+    logger.info(f"Committed batch {batch_id} ({len(batch_files)} files)")
+
+
+def recover_unfinished_batches(journal, read_path, conn_dic, resume):
+    """ Settles batches a previous run left unfinished, using the db commit marker as the source of truth.
+
+    Committed batches just have their files moved to done/; the others are abandoned, and since their files were
+    never moved they are simply parsed again by this run.
+    """
+    unfinished = journal.unfinished()
+    if not unfinished:
+        return
+    if not resume:
+        sys.exit(f"Found {len(unfinished)} unfinished batch(es) in {journal.path}, rerun with --resume")
+
+    for batch_id, batch_files in unfinished.items():
+        if db_builder.is_batch_committed(batch_id, conn_dic["cursor"]):
+            for f in batch_files:
+                if os.path.exists(f):
+                    move_to_done(read_path, f)
+            journal.mark_done(batch_id)
+            logger.info(f"Batch {batch_id} was committed before the interruption, moved its files to done")
+        else:
+            journal.mark_abandoned(batch_id)
+            logger.info(f"Batch {batch_id} was never committed, will replay {len(batch_files)} files")
+    db_builder.drop_staging_tables(table_builder.OUTPUT_TABLES, conn_dic)
+
+
+def move_to_done(read_path, f):
+    filename = f.rpartition("/")[2]
+    os.rename(os.path.join(read_path, filename), os.path.join(read_path, "done", filename))
+
+
+_worker_conn_dic = None
+
+
+def _init_worker(db_credentials):
+    global _worker_conn_dic
+    diagnostics.configure(mode=DIAGNOSTICS_MODE, sample_rate=DIAGNOSTICS_SAMPLE_RATE)
+    conn, engine = db_builder.initiate_connections(db_credentials)
+    _worker_conn_dic = {"conn": conn, "engine": engine, "cursor": conn.cursor()}
+    person.get_identity_index(_worker_conn_dic, "competitors")
+
+
+def _transform_workbook(f):
+    """ Worker process entry point: parses one workbook using provisional keys (see id_blocks).
+
+    :return: Tuple of (dict of dataframes, dict of provisional ids used per table, list of quarantine records, list
+             of (competitor id, field, federation) updates for competitors already in the db), or None if the file
+             was skipped
+    """
+    rows = id_blocks.provisional_id_dic()
+    skater_list, tables = [], table_builder.new_table_set()
+    quarantined = [] if FAIL_SOFT else None
+    index = person.get_identity_index(_worker_conn_dic, "competitors")
+    seg = read_workbook(f, rows, skater_list, _worker_conn_dic, tables, quarantined)
+    # Competitors new in this workbook carry provisional ids: the merger de-duplicates them across workbooks instead
+    index.clear_pending()
+    if seg is None:
+        return None
+    dfs = convert_to_dfs(tables=tables, competitor_list=skater_list, id_dic=rows)
+    used_ids = {k: rows[k] - id_blocks.PROVISIONAL_ID_BASE for k in rows}
+    return dfs, used_ids, quarantined or [], index.pop_fed_updates()
+
+
+def transform_and_load(read_path, counter, db_credentials, workers=1, resume=False):
+    """ Parses every workbook in read_path and loads the results into the database in batches.
+
+    A batch is flushed when it holds counter files, when any table reaches its FLUSH_ROW_LIMITS entry or when the
+    batch is estimated to hold FLUSH_MAX_BATCH_MB of memory, whichever comes first.
+
+    :param read_path: Directory holding the .xlsx files
+    :param counter: Maximum number of files per batch, or None to flush on row counts and memory only
+    :param db_credentials: Dict of db credentials
+    :param workers: Number of worker processes to parse workbooks with
+    :param resume: Settle batches left unfinished by an interrupted run, instead of refusing to start
+    """
     done_dir_path = os.path.join(read_path, "done")
     if not os.path.exists(done_dir_path):
         os.makedirs(done_dir_path)
+    diagnostics.configure(mode=DIAGNOSTICS_MODE, sample_rate=DIAGNOSTICS_SAMPLE_RATE)
 
     # --- 1. Initiate connections and fetch ids
     conn, engine = db_builder.initiate_connections(db_credentials)
     cur = conn.cursor()
     conn_dic = {"conn": conn, "engine": engine, "cursor": cur}
 
+    journal = batch_journal.BatchJournal(read_path)
+    recover_unfinished_batches(journal, read_path, conn_dic, resume)
+    index = person.get_identity_index(conn_dic, "competitors")
+    quarantine_log = quarantine.Quarantine(read_path) if FAIL_SOFT else None
+
     # --- 2. Get max table rows for append
     rows = {}
-    for x in ["deductions_detail", "pcs_averages", "pcs_detail", "goe_detail", "elements", "segments", "competitors",
-              "officials", "panels", "protocols"]:
+    for x in id_blocks.ID_TABLES:
         rows[x] = db_builder.get_last_row_key(table_name=x, cursor=cur) + 1
 
     # --- 3. Iteratively read through converted .xlsx and populate tables
-    segment_list, skater_list = [], []
-    file_count = 0
     files = sorted(glob.glob(read_path + '*.xlsx'))
+    policy = flush_policy.FlushPolicy(max_files=counter, row_limits=FLUSH_ROW_LIMITS,
+                                      max_batch_mb=FLUSH_MAX_BATCH_MB)
+    if workers > 1:
+        _transform_and_load_parallel(files, read_path, policy, db_credentials, workers, rows, conn_dic, journal,
+                                     quarantine_log)
+        return
 
-    for f in files:
-        filename = f.rpartition("/")[2]
-        basename = filename.rpartition(".")[0]
-        logger.info(f"Attempting to read {basename}")
-        file_count += 1
+    batch_files, skater_list, tables = [], [], table_builder.new_table_set()
 
-        try:
-            disc = event.parse_discipline(filename)
-        except ValueError:
-            logger.error(f"Passing on file {filename}")
+    for f in files:
+        quarantined = [] if FAIL_SOFT else None
+        seg = read_workbook(f, rows, skater_list, conn_dic, tables, quarantined)
+        if seg is None:
             continue
+        for record in quarantined or []:
+            quarantine_log.add(record)
+        batch_files.append(f)
+
+        reason = policy.flush_reason(len(batch_files), table_builder.row_counts(tables),
+                                    table_builder.estimated_bytes(tables))
+        if reason:
+            logger.info(f"Flushing batch after {f}: reached {reason}")
+            commit_batch(convert_to_dfs(tables=tables, competitor_list=skater_list, id_dic=rows), batch_files,
+                         journal, read_path, conn_dic, index.pop_fed_updates())
+            index.commit_pending()
+            batch_files, skater_list, tables = [], [], table_builder.new_table_set()
+
+    if batch_files:
+        commit_batch(convert_to_dfs(tables=tables, competitor_list=skater_list, id_dic=rows), batch_files,
+                     journal, read_path, conn_dic, index.pop_fed_updates())
+        index.commit_pending()
+
+
+def _transform_and_load_parallel(files, read_path, policy, db_credentials, workers, rows, conn_dic, journal,
+                                 quarantine_log=None):
+    """ Parses workbooks in worker processes and loads them in file order.
+
+    Workers each hold their own db connection and number rows provisionally; the IdBlockMerger then reserves a
+    contiguous block of ids per table for each workbook, in file order, so results don't depend on scheduling.
+    At most WORKBOOKS_IN_FLIGHT_PER_WORKER workbooks per worker are submitted ahead of the one being loaded, so parsed
+    results can't pile up in this process when loading is slower than parsing.
+    """
+    merger = id_blocks.IdBlockMerger(next_ids=rows)
+    batch_files = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_credentials,)) as executor:
+        queued, in_flight = deque(files), deque()
+        while queued or in_flight:
+            while queued and len(in_flight) < workers * WORKBOOKS_IN_FLIGHT_PER_WORKER:
+                next_f = queued.popleft()
+                in_flight.append((next_f, executor.submit(_transform_workbook, next_f)))
+            f, future = in_flight.popleft()
+            result = future.result()
+            if result is None:
+                continue
+            (dfs, used_ids, quarantined, fed_updates) = result
+            merger.add(dfs, used_ids, fed_updates)
+            for record in quarantined:
+                quarantine_log.add(record)
+            batch_files.append(f)
+
+            reason = policy.flush_reason(len(batch_files), merger.pending_row_counts(), merger.pending_bytes())
+            if reason:
+                logger.info(f"Flushing batch after {f}: reached {reason}")
+                dfs, fed_updates = merger.pop_batch()
+                commit_batch(dfs, batch_files, journal, read_path, conn_dic, fed_updates)
+                batch_files = []
+
+    if batch_files:
+        dfs, fed_updates = merger.pop_batch()
+        commit_batch(dfs, batch_files, journal, read_path, conn_dic, fed_updates)
+
+
+def _find_segment_id(seg, cursor):
+    """ Returns the id under which a segment was loaded, or None. """
+    cursor.execute("SELECT id FROM segments WHERE name = %s AND start_date = %s AND discipline = %s "
+                   "AND segment IS NOT DISTINCT FROM %s AND category IS NOT DISTINCT FROM %s "
+                   "AND sub_event IS NOT DISTINCT FROM %s;",
+                   (seg.name, seg.start_date, seg.discipline, seg.segment, seg.category, seg.sub_event))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+
+def retry_quarantined(read_path, db_credentials):
+    """ Parses again only the protocols quarantined by earlier fail-soft runs, e.g. after fixing the parser, and loads
+    those that now succeed as one batch. Protocols that still fail stay quarantined with their new error.
+
+    :param read_path: Directory the quarantined files were read from (they may since have moved to done/)
+    :param db_credentials: Dict of db credentials
+    """
+    diagnostics.configure(mode=DIAGNOSTICS_MODE, sample_rate=DIAGNOSTICS_SAMPLE_RATE)
+    conn, engine = db_builder.initiate_connections(db_credentials)
+    cur = conn.cursor()
+    conn_dic = {"conn": conn, "engine": engine, "cursor": cur}
 
-        try:
-            seg = event.ScoredSegment(name_to_parse=basename, discipline=disc, id_dic=rows)
-        except ValueError as ve:
-            logger.error(f"Failed to instantiate ScoredSegment object: {ve}")
-
-        segment_list.append(seg)
-
-        wb = load_workbook(f)
-        for sheet in wb.sheetnames:
-            raw_df = pd.DataFrame(wb[sheet].values)
-            scrape_sheet(df=raw_df, segment=seg, last_row_dic=rows, skater_list=skater_list, conn_dic=conn_dic)
-
-        if file_count % counter == 0:
-            dfs = convert_to_dfs(segment_list=segment_list, competitor_list=skater_list, id_dic=rows)
-
-            for k in dfs:
-                db_builder.create_staging_table(df=dfs[k], conn_dic=conn_dic, table_name=k, fetch_last_row=False)
-
-            if ENABLE_WRITE_PAUSE:
-                input("Hit Enter to write to main tables")
+    journal = batch_journal.BatchJournal(read_path)
+    recover_unfinished_batches(journal, read_path, conn_dic, resume=False)
+    quarantine_log = quarantine.Quarantine(read_path)
+    index = person.get_identity_index(conn_dic, "competitors")
 
-            for k in dfs:
-                db_builder.write_to_final_table(df=dfs[k], conn_dic=conn_dic, table_name=k)
+    rows = {x: db_builder.get_last_row_key(table_name=x, cursor=cur) + 1 for x in id_blocks.ID_TABLES}
+    skater_list, tables, retried, quarantined = [], table_builder.new_table_set(), [], []
 
-            segment_list, skater_list = [], []
+    for filename, sheets in quarantine_log.pending().items():
+        paths = [p for p in [os.path.join(read_path, filename), os.path.join(read_path, "done", filename)]
+                 if os.path.exists(p)]
+        if not paths:
+            logger.error(f"Could not find {filename} in {read_path} or its done/ directory, skipping")
+            continue
+        seg = event.ScoredSegment(name_to_parse=filename.rpartition(".")[0],
+                                  discipline=event.parse_discipline(filename), id_dic={"segments": 0})
+        seg.id = _find_segment_id(seg, cur)
+        if seg.id is None:
+            logger.error(f"Segment of {filename} was never loaded, transform the whole file instead")
+            continue
 
-        current_path = os.path.join(read_path, filename)
-        done_path = os.path.join(done_dir_path, filename)
-        os.rename(current_path, done_path)
+        for sheet_name, grid in grid_cache.iter_sheets(paths[0], cache_dir=GRID_CACHE_DIR):
+            records = sheets.get(sheet_name, [])
+            if not records:
+                continue
+            failed_before = len(quarantined)
+            scrape_sheet(df=pd.DataFrame(grid), segment=seg, last_row_dic=rows, skater_list=skater_list,
+                         conn_dic=conn_dic, tables=tables, source=(filename, sheet_name), quarantined=quarantined,
+                         protocol_coords=[tuple(r["rows"]) for r in records])
+            still_failing = {r["id"] for r in quarantined[failed_before:]}
+            retried.extend(r["id"] for r in records if r["id"] not in still_failing)
+
+    for record in quarantined:
+        quarantine_log.add(record)
+    if retried:
+        commit_batch(convert_to_dfs(tables=tables, competitor_list=skater_list, id_dic=rows), [], journal,
+                     read_path, conn_dic, index.pop_fed_updates())
+        index.commit_pending()
+        quarantine_log.resolve(retried)
+    logger.info(f"Loaded {len(retried)} previously quarantined protocols, {len(quarantined)} still failing")
 
 
 if __name__ == "__main__":
     db_credentials_dic = settings.DB_CREDENTIALS
     read_dir_path = settings.XLSX_READ_PATH
-    file_counter = 1
+    file_counter = None  # Batches are sized by FLUSH_ROW_LIMITS and FLUSH_MAX_BATCH_MB unless a file cap is set
+
+    # Pass --resume to settle batches left unfinished by an interrupted run before carrying on
+    resume_run = "--resume" in sys.argv
+    # Pass --retry-quarantine to re-parse only the protocols earlier fail-soft runs quarantined
+    retry_run = "--retry-quarantine" in sys.argv
+    args = [a for a in sys.argv[1:] if a not in ("--resume", "--retry-quarantine")]
 
-    if len(sys.argv) == 1:
+    if retry_run:
+        retry_quarantined(args[0] if args else read_dir_path, args[2] if len(args) > 2 else db_credentials_dic)
+    elif len(args) == 0:
         # clean_pyeongchang_protocols(read_path)
-        transform_and_load(read_dir_path, file_counter, db_credentials_dic)
+        transform_and_load(read_dir_path, file_counter, db_credentials_dic, workers=WORKER_PROCESSES,
+                           resume=resume_run)
     else:
         # clean_pyeongchang_protocols(read_path)
-        transform_and_load(sys.argv[1], sys.argv[2], sys.argv[3])
+        transform_and_load(args[0], int(args[1]) or None, args[2], resume=resume_run)
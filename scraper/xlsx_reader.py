@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# #!/bin/env python
+
+import re
+import logging
+import zipfile
+import posixpath
+from xml.etree import ElementTree
+
+from openpyxl import load_workbook
+
+logger = logging.getLogger(__name__)
+
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+CELL_REF_PATTERN = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+class XlsxFormatError(ValueError):
+    pass
+
+
+def _column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - 64)
+    return index - 1
+
+
+def _rich_text(node):
+    """ Concatenates the plain and rich-text runs of an <si> or <is> node, ignoring phonetic runs. """
+    parts = []
+    for child in node:
+        if child.tag == MAIN_NS + "t":
+            parts.append(child.text or "")
+        elif child.tag == MAIN_NS + "r":
+            run_text = child.find(MAIN_NS + "t")
+            if run_text is not None:
+                parts.append(run_text.text or "")
+    return "".join(parts)
+
+
+def _cast_number(value):
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def _read_shared_strings(archive):
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as f:
+        for event, node in ElementTree.iterparse(f):
+            if node.tag == MAIN_NS + "si":
+                strings.append(_rich_text(node))
+                node.clear()
+    return strings
+
+
+def _read_sheet_paths(archive):
+    """ Returns (sheet name, archive path) pairs in workbook order. """
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {}
+    for rel in rels.iter(PKG_REL_NS + "Relationship"):
+        target = rel.get("Target")
+        targets[rel.get("Id")] = target.lstrip("/") if target.startswith("/") else posixpath.join("xl", target)
+
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    sheets = []
+    for sheet in workbook.iter(MAIN_NS + "sheet"):
+        sheets.append((sheet.get("name"), targets[sheet.get(REL_NS + "id")]))
+    return sheets
+
+
+def _read_cell_value(cell, shared_strings):
+    cell_type = cell.get("t", "n")
+    if cell_type == "inlineStr":
+        inline = cell.find(MAIN_NS + "is")
+        return _rich_text(inline) if inline is not None else None
+
+    value_node = cell.find(MAIN_NS + "v")
+    if value_node is None or value_node.text is None:
+        return None
+    value = value_node.text
+
+    if cell_type == "s":
+        return shared_strings[int(value)]
+    elif cell_type == "n":
+        return _cast_number(value)
+    elif cell_type == "b":
+        return bool(int(value))
+    elif cell_type in ("str", "e"):
+        return value
+    raise XlsxFormatError(f"Unsupported cell type {cell_type}")
+
+
+def _read_sheet_grid(archive, sheet_path, shared_strings):
+    """ Streams one worksheet into a list of rows, padded to a rectangle anchored on A1.
+
+    Only cell values are kept: styles, formulas and the rest of the object graph are discarded as the XML is read.
+    Numbers are returned as int/float without applying date formats, which the converted protocols do not use.
+    """
+    rows = {}
+    max_row, max_col = 0, 0
+    current_row, next_col = -1, 0
+    sheet_data = None
+
+    with archive.open(sheet_path) as f:
+        for event, node in ElementTree.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if node.tag == MAIN_NS + "row":
+                    row_ref = node.get("r")
+                    current_row = int(row_ref) - 1 if row_ref else current_row + 1
+                    next_col = 0
+                elif node.tag == MAIN_NS + "sheetData":
+                    sheet_data = node
+
+            elif node.tag == MAIN_NS + "c":
+                ref = node.get("r")
+                if ref:
+                    match = CELL_REF_PATTERN.match(ref)
+                    if not match:
+                        raise XlsxFormatError(f"Unexpected cell reference {ref} in {sheet_path}")
+                    col, current_row = _column_index(match.group(1)), int(match.group(2)) - 1
+                else:
+                    col = next_col
+                next_col = col + 1
+
+                max_row, max_col = max(max_row, current_row + 1), max(max_col, col + 1)
+                value = _read_cell_value(node, shared_strings)
+                if value is not None:
+                    rows.setdefault(current_row, {})[col] = value
+
+            elif node.tag == MAIN_NS + "row" and sheet_data is not None:
+                # Drop parsed rows from the tree so memory stays flat however long the sheet is
+                sheet_data.remove(node)
+
+    grid = []
+    for i in range(0, max_row):
+        row = [None] * max_col
+        for j, value in rows.pop(i, {}).items():
+            row[j] = value
+        grid.append(row)
+    return grid
+
+
+def _iter_openpyxl_sheets(path, sheet_names=None):
+    wb = load_workbook(path)
+    for name in wb.sheetnames:
+        if sheet_names is None or name in sheet_names:
+            yield name, [list(row) for row in wb[name].values]
+
+
+def iter_sheets(path):
+    """ Yields (sheet name, grid) pairs for each worksheet of an .xlsx file, one sheet at a time.
+
+    The grid is a list of row lists holding plain cell values (None for empty cells), i.e. the same content as
+    openpyxl's ws.values. Falls back to openpyxl for workbooks (or individual sheets) the streaming reader can't handle.
+
+    :param path: Path to .xlsx file
+    :return: Generator of (sheet name, grid) tuples
+    """
+    try:
+        archive = zipfile.ZipFile(path)
+        try:
+            sheet_paths = _read_sheet_paths(archive)
+            shared_strings = _read_shared_strings(archive)
+        except BaseException:
+            archive.close()
+            raise
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError, XlsxFormatError) as exc:
+        logger.warning(f"Streaming reader could not open {path} ({exc}), falling back to openpyxl")
+        yield from _iter_openpyxl_sheets(path)
+        return
+
+    with archive:
+        for name, sheet_path in sheet_paths:
+            try:
+                grid = _read_sheet_grid(archive, sheet_path, shared_strings)
+            except (KeyError, IndexError, ValueError, ElementTree.ParseError) as exc:
+                logger.warning(f"Streaming reader failed on sheet {name} of {path} ({exc}), falling back to openpyxl")
+                yield from _iter_openpyxl_sheets(path, sheet_names=[name])
+                continue
+            yield name, grid